@@ -1,7 +1,27 @@
+import asyncio
+import itertools
+import os
 import socket
 import json
-import chatClass
+import backgroundJobs
+import changeLog
+import checkpoint
+import crawlerPool
+import entityResolver
 import NPCInfoTest
+import eventBatcher
+import eventScheduler
+import eventServer
+import llmBackend
+import metrics
+import prefetcher
+import promptContext
+import queryIndex
+import relationStore
+import responseCache
+import scoreEngine
+import streamParser
+import subscriptions
 data = [
 {
 "intermediatorID": "Celin",
@@ -35,48 +55,526 @@ data = [
 }
 ]
 
-NPCmap = NPCInfoTest.npc_relation_map("Z:\\bussiness\\Unreal\\UE_projs\\TheProject\\Content\\System\\initialRelations.csv")
-changes = []
-crawler = chatClass.ChatBotCrawler()
+CHANGE_LOG_DIR = "change_log"
+# restarts load the newest checkpoint and replay at most CHECKPOINT_EVERY changes
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_EVERY = 500
+CSV_PATH = "Z:\\bussiness\\Unreal\\UE_projs\\TheProject\\Content\\System\\initialRelations.csv"
 
 HOST = '127.0.0.1'
 PORT = 7777
+# "async": multi-client asyncio server, "blocking": the original single-client loop
+SERVER_MODE = "async"
 
-# Create server socket
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind((HOST, PORT))
-s.listen(1)
-print(f"Server listening on {HOST}:{PORT}...")
-
-conn, addr = s.accept()
-print(f"Client connected from {addr}")
-
-# response = crawler.send_message("Great. Keep this way for now. Many people used you claim that languages that make people motivated or stressed also works for you, how do u think of this case?")
-# print("Bot response:", response)
-
-# Send initial data as JSON
-# conn.sendall(json.dumps(data).encode('utf-8'))
-i = 1
-try:
-    while True:
-        msg = conn.recv(4096)
-        if not msg:
-            print("Client disconnected.")
-            break
-        # print("Received from client", msg.decode('utf-8'))
-        response = crawler.send_message(msg.decode('utf-8'))
-        response_obj = json.loads(response)
-        # print(response)
-        conn.sendall(json.dumps(response_obj, ensure_ascii=False).encode('utf-8') + b'\n')
-
-        data = json.loads(msg.decode('utf-8'))
+# "selenium": the logged-in Chrome chat; "fake": in-process stand-in LLM;
+# "http": stand-ins served by `python llmBackend.py <port>` at FAKE_LLM_URLS
+LLM_BACKEND = "selenium"
+# chat sessions used by the async server: either several tabs of the Chrome on
+# DEBUGGER_ADDRESSES[0], or one session per address when more are listed
+DEBUGGER_ADDRESSES = ["127.0.0.1:9223"]
+POOL_TABS = 1
+# behind worldRouter every world needs a Chrome chat of its own: world id ->
+# its debugger addresses (as DEBUGGER_ADDRESSES). The default world falls back
+# to DEBUGGER_ADDRESSES; other selenium worlds without an entry are refused.
+WORLD_DEBUGGER_ADDRESSES = {}
+# stand-in sessions and their latency distributions (see llmBackend.sample_latency)
+FAKE_SESSIONS = 4
+FAKE_FIRST_TOKEN = ('lognormal', 0.8, 0.4)
+FAKE_TOTAL = ('lognormal', 3.0, 0.5)
+FAKE_LLM_URLS = ["http://127.0.0.1:8765/chat"]
+# LLM turns go out by priority class ("player" > "high" > "normal" > "background",
+# from the event's "priority" field or derived from it, see eventScheduler.classify).
+# Background events (and any with their own "deadline") older than their deadline
+# are dropped, queued background events with the same "mergeKey" (or text)
+# collapse into the newest, and beyond SCHEDULER_MAX_QUEUE waiting events clients
+# get {"type": "busy"}. Only clients that send an eventId or priority get these
+# notices; older clients get an empty reaction list for a dropped event.
+SCHEDULER_MAX_QUEUE = 64
+# while idle, send likely next events (repeats, and recent actors' usual actions
+# toward their relations) to the LLM as background turns and keep the replies in
+# the response cache; at most PREFETCH_PER_MINUTE turns. Needs RESPONSE_CACHE.
+# Speculative prompts are marked hypothetical but still land in the chat history.
+PREFETCH = False
+PREFETCH_IDLE_AFTER = 2.0
+PREFETCH_PER_MINUTE = 12
+PLAYER_NAMES = ["Player"]
+EVENT_DEADLINES = {}   # e.g. {"background": 5.0} overrides eventScheduler.DEFAULT_DEADLINES
+# events from one client handled at the same time; kept above the scheduler's
+# queue so a player event is never stuck behind background ones in arrival order.
+# Events without an eventId (older clients) are still handled one at a time.
+# Past MAX_INBOX_PER_CLIENT unread events the server stops reading that client.
+MAX_IN_FLIGHT_PER_CLIENT = SCHEDULER_MAX_QUEUE + 16
+MAX_INBOX_PER_CLIENT = 256
+# push each reaction record to the client as soon as it has been typed out;
+# a client can also ask for this per event with "stream": true
+STREAM_REPLIES = False
+# reuse replies to repeated events while the NPCs' relations are unchanged;
+# CACHE_DISK_PATH adds a sqlite tier that survives restarts
+RESPONSE_CACHE = True
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL = 3600
+CACHE_DISK_PATH = None
+# send events that arrive within BATCH_WINDOW seconds as one prompt (at most
+# BATCH_MAX_EVENTS per prompt); batched replies are not streamed mid-turn
+MICRO_BATCH = False
+BATCH_WINDOW = 0.05
+BATCH_MAX_EVENTS = 8
+# add the participants' neighbourhood in NPCmap to each event as
+# "relationContext", so the chat does not need a hand-pasted world dump
+PROMPT_CONTEXT = True
+CONTEXT_HOPS = 1
+CONTEXT_TOKEN_BUDGET = 300
+# start a fresh chat after ROTATE_AFTER_TURNS turns or once recent turns
+# average ROTATE_LATENCY seconds; the new chat gets PRIMING_PROMPT_PATH plus a
+# summary of NPCmap. Rotation is off while the priming prompt file is missing.
+PRIMING_PROMPT_PATH = "priming_prompt.txt"
+ROTATE_AFTER_TURNS = 150
+ROTATE_LATENCY = 20.0
+SUMMARY_TOKEN_BUDGET = 1500
+# per-stage timing histograms at http://127.0.0.1:METRICS_PORT/metrics (None
+# turns the endpoint off); TRACE_LOG_PATH appends one JSON line per turn
+METRICS_PORT = 9464
+TRACE_LOG_PATH = None
+# clients send {"type": "subscribe", "npcs": [...], "pairs": [[src, tgt]]} to get
+# {"type": "delta"} pushes; changes to one pair within SUBSCRIPTION_TICK are merged.
+# Queries ("relation", "relations", "sources", "pairs", "history") are listed in queryIndex.QueryService;
+# "history" indexes the newest HISTORY_WINDOW changes and reads older ones back from the log
+SUBSCRIPTION_TICK = 0.05
+HISTORY_WINDOW = 20000
+# NPC names from the LLM are resolved to one canonical key: CSV IDs, given
+# names/epithets, fuzzy matches, plus {"alias": "Canonical"} from this file
+NPC_ALIASES_PATH = "npc_aliases.json"
+# every SCORE_TICK seconds AttitudeScores decay toward their CSV value
+# (SCORE_HALF_LIFE seconds), drift toward the scores of the NPCs one likes
+# (SCORE_GOSSIP_RATE per second) and move toward the LLM's latest attitude or
+# relation label; subscribers get moves of a point or more as score deltas
+SCORE_ENGINE = True
+SCORE_TICK = 1.0
+SCORE_HALF_LIFE = 3600.0
+SCORE_GOSSIP_RATE = 0.02
+# `python worldRouter.py` serves many worlds on PORT: a client's first line
+# {"type": "world", "world": "<id>"} picks its world, each world is hosted by
+# one of ROUTER_WORKERS processes on a port from WORKER_BASE_PORT up and keeps
+# its change log, checkpoints and viewer under WORLDS_DIR/<id>/. Clients that
+# name no world get DEFAULT_WORLD.
+WORLDS_DIR = "worlds"
+DEFAULT_WORLD = "default"
+ROUTER_WORKERS = 4
+WORKER_BASE_PORT = 7800
+DRAIN_TIMEOUT = 30.0
+# maintenance stays off the event loop: checkpoints are written on a job
+# thread, the change viewer and the history analytics (npc_analytics.json) are
+# rebuilt in a job process at most every VIEWER_EXPORT_EVERY / ANALYTICS_EVERY
+# seconds while changes come in. COMPACT_CHANGE_LOG deletes log segments older
+# than the kept checkpoints, and with them the viewer's old history.
+BACKGROUND_JOBS = True
+JOB_THREADS = 1
+JOB_PROCESSES = 1
+JOB_QUEUE_DEPTH = 16
+VIEWER_EXPORT_EVERY = 30.0
+ANALYTICS_EVERY = 60.0
+COMPACT_CHANGE_LOG = False
+
+
+class World:
+    """NPC map and change history shared by every connected client."""
+
+    def __init__(self, npc_map, changes=None, checkpointer=None, resolver=None, world_id=None, jobs=None,
+                 baseline=None):
+        self.world_id = world_id
+        self.baseline = baseline   # the CSV map AttitudeScores decay toward; None: the scores at start
+        self.jobs = jobs      # backgroundJobs.JobQueue for exports and maintenance
+        self.npc_map = npc_map
+        self.changes = changes if changes is not None else []
+        self.checkpointer = checkpointer
+        self.resolver = resolver if resolver is not None else entityResolver.NameResolver.from_map(npc_map)
+        self.event_count = 0
+        self.clients = 0      # connected sessions, each until its last event is handled
+        self.listeners = []   # called with every applied change record
+
+    def _notify(self, change):
+        for listener in self.listeners:
+            listener(change)
+
+    def apply(self, msg, response_obj):
+        data = json.loads(msg)
         event = data.get("starterAndAction")
-        event = "Event " + str(i) + event
-        i+=1
-        NPCmap, changes = NPCInfoTest.update_npc_map_with_messages(event, NPCmap, response_obj, changes)
-except KeyboardInterrupt:
-    print("Shutting down server.")
-
-NPCInfoTest.store_change_history(changes)
-conn.close()
-s.close()
+        self.event_count += 1
+        event = "Event " + str(self.event_count) + event
+        with metrics.span('map_update'):
+            self.npc_map, self.changes = NPCInfoTest.update_npc_map_with_messages(
+                event, self.npc_map, response_obj, self.changes,
+                self._notify if self.listeners else None, self.resolver.resolve)
+        if self.checkpointer:
+            with metrics.span('checkpoint'):
+                self.checkpointer.maybe_checkpoint()
+
+
+def run_blocking(world, crawler):
+    # Create server socket
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((HOST, PORT))
+    s.listen(1)
+    print(f"Server listening on {HOST}:{PORT}...")
+
+    conn, addr = s.accept()
+    print(f"Client connected from {addr}")
+
+    framer = eventServer.MessageFramer()
+    try:
+        while True:
+            with metrics.span('recv'):
+                chunk = conn.recv(4096)
+            if not chunk:
+                print("Client disconnected.")
+                break
+            for msg in framer.feed(chunk):
+                with metrics.span('llm'):
+                    response = crawler.send_message(msg)
+                with metrics.span('json_decode'):
+                    response_obj = json.loads(response)
+                with metrics.span('send'):
+                    conn.sendall(json.dumps(response_obj, ensure_ascii=False).encode('utf-8') + b'\n')
+                world.apply(msg, response_obj)
+    finally:
+        conn.close()
+        s.close()
+
+
+def make_pool(world=None):
+    if LLM_BACKEND == "fake":
+        names = (lambda: list(world.npc_map)) if world else None
+        return crawlerPool.CrawlerPool([
+            llmBackend.FakeLLMBackend(names, FAKE_FIRST_TOKEN, FAKE_TOTAL, name=f"fake{i}")
+            for i in range(FAKE_SESSIONS)])
+    if LLM_BACKEND == "http":
+        return crawlerPool.CrawlerPool([llmBackend.HTTPLLMBackend(url) for url in FAKE_LLM_URLS])
+    world_id = world.world_id if world else None
+    addresses = WORLD_DEBUGGER_ADDRESSES.get(world_id)
+    if not addresses:
+        if world_id not in (None, DEFAULT_WORLD):
+            # sharing one chat would mix several worlds' events in one conversation
+            raise ValueError(f"no Chrome for world {world_id!r}; add it to WORLD_DEBUGGER_ADDRESSES")
+        addresses = DEBUGGER_ADDRESSES
+    if len(addresses) > 1:
+        return crawlerPool.CrawlerPool.from_ports(addresses)
+    return crawlerPool.CrawlerPool.from_tabs(addresses[0], tabs=POOL_TABS)
+
+
+def tag_reply(data, records):
+    # clients that tag their events get the tag back, since with several
+    # sessions replies can arrive out of order; old clients get the bare list
+    if isinstance(data, dict) and 'eventId' in data:
+        return {'eventId': data['eventId'], 'records': records}
+    return records
+
+
+def stream_message(data, **fields):
+    # one newline-delimited message per streamed record, plus a closing "done"
+    if isinstance(data, dict) and 'eventId' in data:
+        return dict(eventId=data['eventId'], **fields)
+    return fields
+
+
+def configure_rotation(pool, world):
+    if not hasattr(pool, 'set_rotation'):
+        return
+    if not os.path.exists(PRIMING_PROMPT_PATH):
+        print(f"No {PRIMING_PROMPT_PATH}; chat rotation disabled")
+        return
+    with open(PRIMING_PROMPT_PATH, encoding="utf-8") as f:
+        priming = f.read().strip()
+    summarizer = promptContext.ContextBuilder(world.npc_map, world.changes)
+    loop = asyncio.get_running_loop()
+
+    async def digest():
+        return summarizer.summary(SUMMARY_TOKEN_BUDGET)
+
+    def seed():
+        # runs on a crawler thread; the map and the change tail are only read on the loop
+        summary = asyncio.run_coroutine_threadsafe(digest(), loop).result()
+        return priming + "\n\nCurrent NPC relationships (source>target: attitude/relation (score)):\n" + summary
+
+    pool.set_rotation(seed, ROTATE_AFTER_TURNS, ROTATE_LATENCY)
+
+
+def make_cache(disk_path=CACHE_DISK_PATH):
+    if not RESPONSE_CACHE:
+        return None
+    return responseCache.ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL, disk_path)
+
+
+def make_jobs():
+    if not BACKGROUND_JOBS:
+        return None
+    return backgroundJobs.JobQueue(JOB_QUEUE_DEPTH, JOB_THREADS, JOB_PROCESSES)
+
+
+def world_paths(world_id=None):
+    """Change log dir, checkpoint dir, viewer and analytics paths; the top-level ones without a world id."""
+    root = os.path.join(WORLDS_DIR, world_id) if world_id is not None else ""
+    return (os.path.join(root, CHANGE_LOG_DIR), os.path.join(root, CHECKPOINT_DIR),
+            os.path.join(root, "npc_viewer.html"), os.path.join(root, "npc_analytics.json"))
+
+
+def open_world(world_id=None, jobs=None):
+    log_dir, checkpoint_dir, _, _ = world_paths(world_id)
+    changes = changeLog.ChangeLog(log_dir)
+    base = {}
+
+    def load_base():
+        base['map'] = NPCInfoTest.npc_relation_map(CSV_PATH)
+        return base['map']
+
+    npc_map, _ = checkpoint.restore(checkpoint_dir, changes, load_base)
+    if SCORE_ENGINE and 'map' not in base and os.path.exists(CSV_PATH):
+        load_base()   # restored from a checkpoint: scores still decay toward the CSV
+    world = World(npc_map, changes,
+                  checkpoint.Checkpointer(npc_map, changes, checkpoint_dir, every_records=CHECKPOINT_EVERY,
+                                          jobs=jobs),
+                  entityResolver.NameResolver.from_map(npc_map, NPC_ALIASES_PATH), world_id, jobs,
+                  base.get('map'))
+    # event numbers carry on across restarts, so history queries by event stay ordered
+    if changes.tail:
+        world.event_count = queryIndex.event_number(changes.tail[-1])
+    return world
+
+
+def close_world(world):
+    # blocking: a loop that hosts other worlds runs this in an executor
+    _, checkpoint_dir, viewer_path, analytics_path = world_paths(world.world_id)
+    if world.jobs:
+        # this world's queued exports and checkpoints first (the queue may be shared); the final ones run here
+        world.jobs.flush([('checkpoint', checkpoint_dir), ('compact', checkpoint_dir),
+                          ('viewer', viewer_path), ('analytics', analytics_path)])
+    NPCInfoTest.store_change_history(world.changes, viewer_path)
+    world.checkpointer.checkpoint(background=False)
+    world.changes.close()
+
+
+async def run_async(world, pool, cache=None, host=None, port=None):
+    # LLM turns run on the pool's threads while the loop keeps serving clients
+    next_id = itertools.count(1)
+
+    async def ask_llm(prompt, on_update=None, trace=None):
+        result = await asyncio.wrap_future(pool.submit(next(next_id), prompt, on_update, trace))
+        if result.wait:
+            print(f"Event {result.event_id}: {result.session} replied in {result.elapsed:.2f}s, "
+                  f"{result.wait['seconds']:.2f}s waiting for completion ({result.wait['method']})")
+        return result.text
+
+    batcher = eventBatcher.MicroBatcher(ask_llm, BATCH_WINDOW, BATCH_MAX_EVENTS) if MICRO_BATCH else None
+    context = promptContext.ContextBuilder(world.npc_map, world.changes, CONTEXT_HOPS,
+                                           CONTEXT_TOKEN_BUDGET) if PROMPT_CONTEXT else None
+    configure_rotation(pool, world)
+
+    trace_log = metrics.TraceLog(TRACE_LOG_PATH) if TRACE_LOG_PATH else None
+    hub = subscriptions.SubscriptionHub(world.npc_map, SUBSCRIPTION_TICK, world.resolver.normalize)
+    world.listeners.append(hub.notify)
+    history = queryIndex.HistoryIndex(world.changes, HISTORY_WINDOW)
+    world.listeners.append(history.add)
+    def on_scores(records):
+        for record in records:
+            hub.notify(record)
+        if world.checkpointer:
+            # score moves are not logged; only checkpoints keep them across a restart
+            world.checkpointer.maybe_checkpoint()
+
+    scores = None
+    if SCORE_ENGINE and isinstance(world.npc_map, relationStore.RelationStore):
+        scores = scoreEngine.ScoreEngine(world.npc_map, SCORE_HALF_LIFE, SCORE_GOSSIP_RATE,
+                                         on_scores=on_scores, baseline=world.baseline)
+        world.listeners.append(scores.fold_change)
+        scores.start(SCORE_TICK)
+    maintenance = None
+    if world.jobs:
+        _, _, viewer_path, analytics_path = world_paths(world.world_id)
+        maintenance = backgroundJobs.Maintenance(world, world.jobs, viewer_path, VIEWER_EXPORT_EVERY,
+                                                 analytics_path, ANALYTICS_EVERY, COMPACT_CHANGE_LOG)
+        world.listeners.append(maintenance.notify)
+        maintenance.start()
+    queries = queryIndex.QueryService(world.npc_map, history, world.resolver.normalize)
+    # non-event requests, by their "type"; each returns the reply object
+    requests = {'subscribe': hub.handle, 'unsubscribe': hub.handle}
+    requests.update((kind, queries.handle) for kind in queries.TYPES)
+
+    async def on_connect(session):
+        world.clients += 1
+
+    async def on_disconnect(session):
+        hub.drop(session)
+        world.clients -= 1
+
+    def on_pressure(paused, depth):
+        # tell every client when to hold back (and resume) low-priority events
+        for session in list(server.sessions):
+            if session.tagged:
+                session.send_nowait({'type': 'backpressure', 'paused': paused, 'queued': depth})
+
+    slots = pool.size * (BATCH_MAX_EVENTS if batcher else 1)
+    scheduler = eventScheduler.PriorityScheduler(slots, SCHEDULER_MAX_QUEUE, EVENT_DEADLINES,
+                                                 on_pressure=on_pressure)
+    prefetch = None
+    if PREFETCH and cache:
+        participants = context.participants if context else (
+            lambda d: NPCInfoTest.event_participants(d, world.npc_map))
+        prepare = (lambda d: context.add_context(json.dumps(d, ensure_ascii=False), d)) if context else None
+        prefetch = prefetcher.Prefetcher(world, cache, ask_llm, scheduler, participants, prepare,
+                                         PREFETCH_IDLE_AFTER, PREFETCH_PER_MINUTE)
+        prefetch.start()
+
+    async def on_message(session, msg):
+        loop = asyncio.get_running_loop()
+        turn_start = loop.time()
+        trace = metrics.TurnTrace()
+        with metrics.span('parse', trace):
+            if isinstance(msg, str):
+                data = json.loads(msg)
+            else:
+                # framed clients deliver decoded objects; the prompt is still JSON text
+                data, msg = msg, json.dumps(msg, ensure_ascii=False)
+        if isinstance(data, dict):
+            handler = requests.get(data.get('type'))
+            if handler is not None:
+                reply = handler(session, data)
+                if 'requestId' in data:
+                    reply['requestId'] = data['requestId']
+                await session.send(reply)
+                return
+            trace.event_id = data.get('eventId')
+            if 'eventId' in data or 'priority' in data:
+                session.tagged = True
+        on_update = parser = None
+        if STREAM_REPLIES or (isinstance(data, dict) and data.get('stream')):
+            parser = streamParser.IncrementalArrayParser()
+
+            def push(text):
+                for record in parser.feed(text):
+                    session.send_nowait(stream_message(data, record=record))
+
+            # partial replies arrive on the crawler thread, parse them on the loop
+            on_update = lambda text: loop.call_soon_threadsafe(push, text)
+
+        if prefetch and isinstance(data, dict):
+            prefetch.observe(data)
+        with metrics.span('cache_lookup', trace):
+            cache_key = cache.key(data, world.npc_map) if cache else None
+            text = cache.get(cache_key) if cache else None
+        if text is not None:
+            source = 'cache'
+            response_obj = json.loads(text)
+            if prefetch:
+                prefetch.used(cache_key)
+        else:
+            event = data if isinstance(data, dict) else {}
+            priority = eventScheduler.classify(event, PLAYER_NAMES)
+            merge_key = event.get('mergeKey') or (
+                event.get('starterAndAction') if priority == 'background' else None)
+            try:
+                with metrics.span('queue_wait', trace):
+                    await scheduler.acquire(priority, event.get('deadline'), merge_key)
+            except eventScheduler.Dropped as e:
+                if session.tagged:
+                    reply = {'type': 'busy' if e.reason == 'busy' else 'dropped', 'reason': e.reason}
+                    if e.retry_after:
+                        reply['retryAfter'] = e.retry_after
+                    if 'eventId' in event:
+                        reply['eventId'] = event['eventId']
+                else:
+                    reply = []   # old clients parse one reaction array per event
+                await session.send(reply)
+                metrics.REGISTRY.inc('npc_events_total', source=e.reason)
+                return
+            try:
+                # built after the wait, so it sees every change applied meanwhile
+                if cache:
+                    cache_key = cache.key(data, world.npc_map)
+                with metrics.span('context', trace):
+                    prompt = context.add_context(msg, data) if context else msg
+                if batcher:
+                    source = 'batch'
+                    with metrics.span('llm', trace):
+                        response_obj = await batcher.submit(prompt, json.loads(prompt))
+                    text = json.dumps(response_obj, ensure_ascii=False)
+                else:
+                    source = 'llm'
+                    with metrics.span('llm', trace):
+                        text = await ask_llm(prompt, on_update, trace)
+                    with metrics.span('json_decode', trace):
+                        response_obj = json.loads(text)
+            finally:
+                scheduler.release()
+            # only cache it if the relations it was generated from did not move during the turn
+            if cache and cache.key(data, world.npc_map) == cache_key:
+                cache.put(cache_key, text)
+        with metrics.span('send', trace):
+            if parser:
+                # anything the parser had not picked up mid-stream goes out now
+                push(text)
+                for record in response_obj[parser.count:]:
+                    session.send_nowait(stream_message(data, record=record))
+                await session.send(stream_message(data, done=True, records=len(response_obj)))
+            else:
+                await session.send(tag_reply(data, response_obj))
+        with metrics.use_trace(trace):
+            world.apply(msg, response_obj)
+        metrics.record('turn', loop.time() - turn_start, trace)
+        metrics.REGISTRY.inc('npc_events_total', source=source)
+        if trace_log:
+            trace.fields['source'] = source
+            trace_log.write(trace)
+
+    server = eventServer.EventServer(host or HOST, port or PORT, on_message, on_connect, on_disconnect,
+                                     max_in_flight=MAX_IN_FLIGHT_PER_CLIENT, max_inbox=MAX_INBOX_PER_CLIENT)
+    try:
+        await server.serve_forever()
+    finally:
+        # a worker keeps its loop running after one of its worlds closes
+        for background in (scores, maintenance, prefetch):
+            if background:
+                background.stop()
+        await server.close()
+        pool.close()
+        if cache:
+            print("Response cache:", cache.stats())
+            cache.close()
+        if batcher and batcher.batches:
+            print(f"Micro-batching: {batcher.events} events in {batcher.batches} prompts")
+        if trace_log:
+            trace_log.close()
+        print("Scheduler:", scheduler.stats)
+        if prefetch:
+            prefetch.stop()
+            print(f"Prefetch: {prefetch.stats}, hit rate {prefetch.hit_rate():.0%}")
+        if scores:
+            scores.stop()
+            world.listeners.remove(scores.fold_change)
+        if maintenance:
+            maintenance.stop()
+            world.listeners.remove(maintenance.notify)
+            print("Background jobs:", world.jobs.stats)
+        world.listeners.remove(hub.notify)
+        world.listeners.remove(history.add)
+
+
+def main():
+    jobs = make_jobs()
+    world = open_world(jobs=jobs)
+    if METRICS_PORT:
+        metrics.serve(HOST, METRICS_PORT)
+    try:
+        if SERVER_MODE == "blocking":
+            run_blocking(world, make_pool(world))
+        else:
+            asyncio.run(run_async(world, make_pool(world), make_cache()))
+    except KeyboardInterrupt:
+        print("Shutting down server.")
+
+    close_world(world)
+    if jobs:
+        jobs.close()
+    print(metrics.REGISTRY.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
+import hashlib
 import json
+import os
+import pickle
+import re
 
+import numpy as np
 import pandas as pd
 
 
 # Read CSV (change the path to your file)
 
 
-def npc_relation_map(filepath):
+RELATION_COLUMNS = ['Attitude', 'AttitudeScore', 'relation']
+
+
+def npc_relation_map_iterrows(filepath):
+    # original row-by-row loader, kept as the benchmark baseline
     df = pd.read_csv(filepath)
     npc_map = {}
     for _, row in df.iterrows():
@@ -23,6 +32,111 @@ def npc_relation_map(filepath):
     return npc_map
 
 
+def _strip_digits(column):
+    return column.astype(str).str.replace(r'\d+', '', regex=True)
+
+
+def _load_relation_csv(filepath):
+    df = pd.read_csv(filepath, usecols=['SourceNPCID', 'TargerNPCID'] + RELATION_COLUMNS)
+    src = _strip_digits(df['SourceNPCID'])
+    tgt = _strip_digits(df['TargerNPCID']).tolist()
+    records = df[RELATION_COLUMNS].to_dict('records')
+
+    # group rows by source (first-appearance order), then build each inner
+    # dict in one go; later duplicate pairs win like the row-by-row loader
+    codes, sources = pd.factorize(src, sort=False)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    npc_map = {}
+    for name, rows in zip(sources.tolist(), np.split(order, bounds)):
+        rows = rows.tolist()
+        npc_map[name] = dict(zip([tgt[i] for i in rows], [records[i] for i in rows]))
+    return npc_map
+
+
+def _csv_signature(filepath, with_hash):
+    st = os.stat(filepath)
+    sig = {'mtime': st.st_mtime_ns, 'size': st.st_size}
+    if with_hash:
+        h = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        sig['sha1'] = h.hexdigest()
+    return sig
+
+
+def npc_relation_map(filepath, use_snapshot=True):
+    """
+    Load initialRelations.csv into {src: {tgt: {Attitude, AttitudeScore, relation}}}.
+    A pickle snapshot is kept next to the CSV (<csv>.snapshot.pkl) and reused
+    while the CSV's mtime/size, or failing that its sha1, still match.
+    """
+    if not use_snapshot:
+        return _load_relation_csv(filepath)
+
+    snapshot_path = filepath + '.snapshot.pkl'
+    sig = _csv_signature(filepath, with_hash=False)
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snap = pickle.load(f)
+        if snap['mtime'] == sig['mtime'] and snap['size'] == sig['size']:
+            return snap['npc_map']
+        sig = _csv_signature(filepath, with_hash=True)
+        if snap.get('sha1') == sig['sha1']:
+            return snap['npc_map']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    npc_map = _load_relation_csv(filepath)
+    if 'sha1' not in sig:
+        sig = _csv_signature(filepath, with_hash=True)
+    try:
+        tmp = snapshot_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(dict(sig, npc_map=npc_map), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, snapshot_path)
+    except OSError as e:
+        print(f"Could not write relation snapshot {snapshot_path}: {e}")
+    return npc_map
+
+
+def event_participants(data, npc_map, lookup=None):
+    """
+    NPC names (as keyed in npc_map) mentioned anywhere in an event payload,
+    matched case-insensitively on whole words. Returned sorted. Callers that
+    keep a {casefolded name: name} table can pass it as `lookup`.
+    """
+    if lookup is None:
+        lookup = {name.casefold(): name for name in npc_map}
+    found = set()
+
+    def walk(v):
+        if isinstance(v, dict):
+            for x in v.values():
+                walk(x)
+        elif isinstance(v, list):
+            for x in v:
+                walk(x)
+        elif isinstance(v, str):
+            for word in re.findall(r"[^\W\d_]+", v):
+                name = lookup.get(word.casefold())
+                if name is not None:
+                    found.add(name)
+
+    walk(data)
+    return sorted(found)
+
+
+def relation_fingerprint(npc_map, names):
+    """Short hash of the outgoing relations of `names`; changes whenever any of them changes."""
+    h = hashlib.sha1()
+    for src in sorted(names):
+        for tgt, rel in sorted((npc_map.get(src) or {}).items()):
+            h.update(repr((src, tgt, rel.get('Attitude'), rel.get('relation'))).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
 def _normalize_change_records(messages):
     """
     Always build (src, tgt) = (intermediatorID, other).
@@ -64,12 +178,19 @@ def _normalize_change_records(messages):
 
 
 
-def update_npc_map_with_messages(event, npc_map, messages, changes):
-    npc_map = npc_map or {}
-    changes  = changes or []
+def update_npc_map_with_messages(event, npc_map, messages, changes, on_change=None, resolve=None):
+    # explicit None checks: an empty RelationStore or change log is still the one to update
+    # on_change(record) is called with every change record after it is applied;
+    # resolve(name) gives the canonical map key (e.g. an entityResolver.NameResolver)
+    if npc_map is None:
+        npc_map = {}
+    if changes is None:
+        changes = []
+    if resolve is None:
+        resolve = str.capitalize
 
     for rec in _normalize_change_records(messages):
-        src, tgt = rec['source'].capitalize(), rec['target'].capitalize()
+        src, tgt = resolve(rec['source']), resolve(rec['target'])
 
 
         # READ originals using resolved keys
@@ -88,7 +209,7 @@ def update_npc_map_with_messages(event, npc_map, messages, changes):
                                        rec.get('intermediatorDialogue'),
                                        rec.get('RecipientDialogue'),
                                        rec.get('Rationale'))):
-            changes.append({
+            change = {
                 'event': event,
                 'source': src, 'target': tgt,
                 'originalAttitude': orig_att, 'newAttitude': new_att,
@@ -96,14 +217,70 @@ def update_npc_map_with_messages(event, npc_map, messages, changes):
                 'intermediatorDialogue': rec.get('intermediatorDialogue'),
                 'RecipientDialogue': rec.get('RecipientDialogue'),
                 'Rationale': rec.get('Rationale')
-            })
+            }
+            seq = changes.append(change)  # a ChangeLog returns the record's seq
+            if on_change is not None:
+                change['seq'] = seq if seq is not None else len(changes)
+                on_change(change)
     return npc_map, changes
 
 
-def store_change_history(changes):
-    import json, html
+VIEWER_FIELDS = ('event', 'source', 'target', 'originalAttitude', 'newAttitude',
+                 'originalRelation', 'newRelation', 'intermediatorDialogue', 'RecipientDialogue', 'Rationale')
+
+
+def _write_viewer_chunks(changes, data_dir, chunk_size):
+    """
+    Group records by (source, target), pack them into chunk files of at most
+    `chunk_size` records and return (source -> targets, pair -> [[chunk, start, count], ...]).
+    Chunks are JSONP-style .js files so the viewer can load them from file://.
+    """
+    by_pair = {}
+    for c in changes:
+        if c.get('source') and c.get('target'):
+            by_pair.setdefault((c['source'], c['target']), []).append({k: c.get(k) for k in VIEWER_FIELDS})
+
+    os.makedirs(data_dir, exist_ok=True)
+    for name in os.listdir(data_dir):
+        if name.startswith('chunk_') and name.endswith('.js'):
+            os.remove(os.path.join(data_dir, name))
+
+    sources, pair_index = {}, {}
+    chunk, chunk_id = [], 0
+
+    def flush():
+        nonlocal chunk, chunk_id
+        with open(os.path.join(data_dir, f"chunk_{chunk_id:05d}.js"), "w", encoding="utf-8") as cf:
+            cf.write(f"NPCViewer.loaded({chunk_id}, ")
+            json.dump(chunk, cf, ensure_ascii=False)
+            cf.write(");\n")
+        chunk, chunk_id = [], chunk_id + 1
+
+    for (src, tgt), records in sorted(by_pair.items()):
+        sources.setdefault(src, []).append(tgt)
+        spans = pair_index[src + '\u0000' + tgt] = []
+        while records:
+            room = chunk_size - len(chunk)
+            part, records = records[:room], records[room:]
+            spans.append([chunk_id, len(chunk), len(part)])
+            chunk.extend(part)
+            if len(chunk) >= chunk_size:
+                flush()
+    if chunk:
+        flush()
+    return sources, pair_index
+
+
+def store_change_history(changes, path="npc_viewer.html", chunk_size=500):
+    """
+    Write the change viewer. The HTML only embeds the source/target indexes;
+    records go to <path>_data/chunk_*.js and are loaded per selected pair.
+    """
+    data_dir = os.path.splitext(path)[0] + '_data'
+    # `changes` may be a ChangeLog, which streams its records back from disk
+    sources, pair_index = _write_viewer_chunks(changes, data_dir, chunk_size)
 
-    with open("npc_viewer.html", "w", encoding="utf-8") as f:
+    with open(path, "w", encoding="utf-8") as f:
         f.write(r'''
 <!DOCTYPE html>
 <html>
@@ -144,10 +321,13 @@ def store_change_history(changes):
   </div>
   <div id="events"></div>
   <script>
-    // Injected from Python:
-    const changes =
-''')
-        json.dump(changes, f, ensure_ascii=False, indent=2)
+    // Injected from Python: source -> targets, and "source\u0000target" -> [[chunk, start, count], ...]
+    const dataDir = ''')
+        json.dump(os.path.basename(data_dir), f)
+        f.write(';\n    const sources = ')
+        json.dump(sources, f, ensure_ascii=False)
+        f.write(';\n    const pairIndex = ')
+        json.dump(pair_index, f, ensure_ascii=False)
         f.write(';\n')
         f.write(r'''
 // ---------- Helpers ----------
@@ -161,8 +341,35 @@ function arrowRow(label, oldV, newV){
   return `<div class="kv"><strong>${label}:</strong> <span>${left}</span><span class="arrow"> → </span><span>${right}</span></div>`;
 }
 
-// Build list of unique NPC names that appeared as a source
-const names = Array.from(new Set(changes.map(c => c.source).filter(Boolean))).sort();
+// Chunk files call NPCViewer.loaded(id, records); each is fetched once, on demand
+const NPCViewer = { chunks: {}, waiting: {} };
+NPCViewer.loaded = (id, records) => {
+  NPCViewer.chunks[id] = records;
+  (NPCViewer.waiting[id] || []).forEach(resolve => resolve(records));
+  delete NPCViewer.waiting[id];
+};
+function loadChunk(id) {
+  if (NPCViewer.chunks[id]) return Promise.resolve(NPCViewer.chunks[id]);
+  return new Promise((resolve, reject) => {
+    if (!NPCViewer.waiting[id]) {
+      NPCViewer.waiting[id] = [];
+      const s = document.createElement('script');
+      s.src = `${dataDir}/chunk_${String(id).padStart(5, '0')}.js`;
+      s.onerror = () => reject(new Error(`could not load ${s.src}`));
+      document.head.appendChild(s);
+    }
+    NPCViewer.waiting[id].push(resolve);
+  });
+}
+async function loadPair(src, tgt) {
+  const spans = pairIndex[src + '\u0000' + tgt] || [];
+  const parts = await Promise.all(spans.map(([id, start, count]) =>
+    loadChunk(id).then(records => records.slice(start, start + count))));
+  return parts.flat();
+}
+
+// NPC names that appeared as a source
+const names = Object.keys(sources).sort();
 
 let source = null, target = null;
 const tagsDiv       = document.getElementById('tags');
@@ -181,9 +388,7 @@ names.forEach(n => {
     source = n;
 
     // targets tied to this source
-    const possibleTargets = Array.from(new Set(
-      changes.filter(c => c.source === source && hasVal(c.target)).map(c => c.target)
-    )).sort();
+    const possibleTargets = (sources[source] || []).slice().sort();
 
     targetSelect.innerHTML = '';
     possibleTargets.forEach(x => {
@@ -209,11 +414,14 @@ targetSelect.onchange = () => {
   renderEvents();
 };
 
-function renderEvents() {
+async function renderEvents() {
   eventsDiv.innerHTML = '';
   if (!source || !target) return;
 
-  const pairEvents = changes.filter(c => c.source === source && c.target === target);
+  const want = [source, target];
+  const pairEvents = await loadPair(source, target);
+  if (want[0] !== source || want[1] !== target) return;  // selection changed while loading
+  eventsDiv.innerHTML = '';
   if (pairEvents.length === 0) {
     eventsDiv.textContent = `No changes recorded between ${source} and ${target}.`;
     return;
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import checkpoint
+import metrics
+import NPCInfoTest
+
+
+class JobQueue:
+    """
+    Maintenance work (exports, checkpoints, compaction, analytics) run off the
+    event loop. Every job has a key and at most one job per key runs at a
+    time. Submitting a key that is already waiting replaces its arguments,
+    so a burst of triggers costs one run with the newest state. A key that
+    is running gets queued once more and starts when the current run ends.
+    At most `max_depth` keys are queued or running; past that, new keys are
+    refused.
+
+    Thread jobs suit file I/O. CPU-heavy jobs should go to the `processes`
+    pool (process=True), so they do not compete with the loop for the GIL.
+    Their function and arguments must pickle.
+    """
+
+    def __init__(self, max_depth=16, threads=1, processes=1):
+        self.max_depth = max_depth
+        self.threads = ThreadPoolExecutor(threads, thread_name_prefix='jobs')
+        # spawn: forking a process that runs LLM and server threads is not safe
+        self.processes = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) \
+            if processes else None
+        self.queued = {}       # key -> (fn, args, process)
+        self.running = set()
+        self.stats = {'submitted': 0, 'coalesced': 0, 'refused': 0, 'done': 0, 'failed': 0}
+        self.idle = threading.Condition()
+
+    def submit(self, key, fn, *args, process=False):
+        """Queue fn(*args) under `key`; False if the queue is full."""
+        with self.idle:
+            if key in self.queued:
+                self.queued[key] = (fn, args, process)
+                self.stats['coalesced'] += 1
+                return True
+            if len(self.queued) + len(self.running) >= self.max_depth:
+                self.stats['refused'] += 1
+                metrics.REGISTRY.inc('npc_jobs_total', job=_job_name(key), outcome='refused')
+                return False
+            self.queued[key] = (fn, args, process)
+            self.stats['submitted'] += 1
+            if key not in self.running:
+                self._start(key)
+            return True
+
+    def _start(self, key):
+        fn, args, process = self.queued.pop(key)
+        self.running.add(key)
+        executor = self.processes if process and self.processes else self.threads
+        started = time.perf_counter()
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._finished(key, f, started))
+
+    def _finished(self, key, future, started):
+        name = _job_name(key)
+        error = future.exception()
+        metrics.REGISTRY.observe('npc_job_seconds', time.perf_counter() - started, job=name)
+        metrics.REGISTRY.inc('npc_jobs_total', job=name, outcome='failed' if error else 'done')
+        if error:
+            print(f"Background job {key!r} failed: {error!r}")
+        with self.idle:
+            self.stats['failed' if error else 'done'] += 1
+            self.running.discard(key)
+            if key in self.queued:
+                self._start(key)
+            self.idle.notify_all()
+
+    def busy(self, keys=None):
+        pending = self.running | set(self.queued)
+        return bool(pending if keys is None else pending & set(keys))
+
+    def flush(self, keys=None, timeout=None):
+        """Block until the given keys (default: all) are neither queued nor running."""
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.busy(keys), timeout)
+
+    def close(self, timeout=None):
+        self.flush(timeout=timeout)
+        self.threads.shutdown()
+        if self.processes:
+            self.processes.shutdown()
+
+
+def _job_name(key):
+    return key[0] if isinstance(key, tuple) else str(key)
+
+
+def history_snapshot(changes):
+    """Something a job can iterate while `changes` keeps growing: a LogSnapshot, or a list copy."""
+    if hasattr(changes, 'snapshot'):
+        return changes.snapshot()
+    return list(changes)
+
+
+def write_history_analytics(changes, path, top=20):
+    """Label counts, attitude transitions and the busiest pairs/NPCs of the change history, as JSON."""
+    attitudes, relations, transitions = Counter(), Counter(), Counter()
+    pairs, npcs = Counter(), Counter()
+    events = set()
+    total, last_seq = 0, 0
+    for c in changes:
+        src, tgt = c.get('source'), c.get('target')
+        if not src or not tgt:
+            continue
+        total += 1
+        last_seq = c.get('seq', total)
+        events.add(c.get('event'))
+        pairs[(src, tgt)] += 1
+        npcs[src] += 1
+        if tgt != src:
+            npcs[tgt] += 1
+        if c.get('newAttitude') is not None:
+            attitudes[c['newAttitude']] += 1
+            transitions[(c.get('originalAttitude'), c['newAttitude'])] += 1
+        if c.get('newRelation') is not None:
+            relations[c['newRelation']] += 1
+    report = {
+        'created': time.time(), 'seq': last_seq, 'changes': total, 'events': len(events),
+        'attitudes': dict(attitudes.most_common()), 'relations': dict(relations.most_common()),
+        'attitudeTransitions': [[a, b, n] for (a, b), n in transitions.most_common(top)],
+        'busiestPairs': [[s, t, n] for (s, t), n in pairs.most_common(top)],
+        'busiestNpcs': [[name, n] for name, n in npcs.most_common(top)],
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return report
+
+
+class Maintenance:
+    """
+    Turns a world's change notifications into background jobs. The World
+    listener `notify` only counts changes. `step` (every `poll` seconds
+    from `run`) queues what is due:
+
+    - the HTML viewer, at most every `viewer_every` s while changes come in;
+    - the history analytics JSON, at most every `analytics_every` s;
+    - with `compact`, log compaction once a newer checkpoint exists.
+      Compaction also drops old history from the viewer and analytics.
+
+    Checkpoints themselves go through the Checkpointer's own `jobs`.
+    """
+
+    def __init__(self, world, jobs, viewer_path=None, viewer_every=30.0, analytics_path=None,
+                 analytics_every=60.0, compact=False):
+        self.world = world
+        self.jobs = jobs
+        self.viewer_path = viewer_path
+        self.viewer_every = viewer_every
+        self.analytics_path = analytics_path
+        self.analytics_every = analytics_every
+        self.compact = compact
+        self.dirty = {'viewer': 0, 'analytics': 0}
+        self.last = {'viewer': 0.0, 'analytics': 0.0}
+        self.compacted_seq = 0
+        self._task = None
+
+    def notify(self, change):
+        self.dirty['viewer'] += 1
+        self.dirty['analytics'] += 1
+
+    def step(self):
+        now = time.monotonic()
+        snapshot = None
+        for name, path, every, fn in (
+                ('viewer', self.viewer_path, self.viewer_every, NPCInfoTest.store_change_history),
+                ('analytics', self.analytics_path, self.analytics_every, write_history_analytics)):
+            if not path or not self.dirty[name] or now - self.last[name] < every:
+                continue
+            if snapshot is None:
+                snapshot = history_snapshot(self.world.changes)
+            if self.jobs.submit((name, path), fn, snapshot, path, process=True):
+                self.dirty[name] = 0
+                self.last[name] = now
+        checkpointer = self.world.checkpointer
+        if self.compact and checkpointer and checkpointer.last_seq > self.compacted_seq and \
+                hasattr(self.world.changes, 'directory'):
+            if self.jobs.submit(('compact', checkpointer.directory), checkpoint.compact,
+                                checkpointer.directory, checkpointer.keep, self.world.changes.directory):
+                self.compacted_seq = checkpointer.last_seq
+
+    async def run(self, poll=1.0):
+        while True:
+            await asyncio.sleep(poll)
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Maintenance step failed: {e!r}")
+
+    def start(self, poll=1.0):
+        self._task = asyncio.ensure_future(self.run(poll))
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,65 @@
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+import NPCInfoTest
+
+ATTITUDES = ['Friendly', 'Neutral', 'Wary', 'Fearful', 'Hostile', 'Protective']
+RELATIONS = ['Friend', 'Stranger', 'Avoid', 'Rival', 'Wife of', 'Neighbour']
+
+
+def npc_name(i):
+    # letters only, so stripping the numeric suffix keeps names distinct
+    name = ''
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        name = chr(ord('a') + r) + name
+    return 'Npc' + name
+
+
+def write_relations_csv(path, npcs, per_npc, seed=7):
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(['SourceNPCID', 'TargerNPCID', 'Attitude', 'AttitudeScore', 'relation'])
+        for i in range(npcs):
+            for j in rng.sample(range(npcs), min(per_npc, npcs)):
+                w.writerow([npc_name(i) + str(i % 10), npc_name(j) + str(j % 10),
+                            rng.choice(ATTITUDES), rng.randint(-100, 100), rng.choice(RELATIONS)])
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(npcs=2000, per_npc=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'initialRelations.csv')
+        write_relations_csv(path, npcs, per_npc)
+        rows = npcs * per_npc
+        print(f"{rows} relation rows, {npcs} NPCs")
+
+        t_iter, expected = timed(lambda: NPCInfoTest.npc_relation_map_iterrows(path), repeat=1)
+        t_cold, cold = timed(lambda: NPCInfoTest.npc_relation_map(path, use_snapshot=False))
+        NPCInfoTest.npc_relation_map(path)  # writes the snapshot
+        t_warm, warm = timed(lambda: NPCInfoTest.npc_relation_map(path))
+
+        # full nested maps: every pair's attitude, score and relation must match
+        same = cold == expected and warm == expected
+        print(f"  iterrows (current) : {t_iter * 1000:9.1f} ms")
+        print(f"  cold CSV (columnar): {t_cold * 1000:9.1f} ms  ({t_iter / t_cold:.1f}x)")
+        print(f"  warm snapshot      : {t_warm * 1000:9.1f} ms  ({t_iter / t_warm:.1f}x)")
+        print(f"  maps identical     : {same}")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import Backend
+import bench_relations
+import changeLog
+import crawlerPool
+import eventServer
+import llmBackend
+import metrics
+import relationStore
+import responseCache
+import wireProtocol
+
+ACTIONS = ["punches", "greets", "insults", "hugs", "steals from", "warns", "ignores", "thanks"]
+RESULTS_DIR = "bench_results"
+
+
+def synthetic_trace(n_events, npc_names, rate, seed=1):
+    """Poisson arrivals at `rate` events/s between random pairs of NPCs."""
+    rng = random.Random(seed)
+    t, trace = 0.0, []
+    for _ in range(n_events):
+        t += rng.expovariate(rate)
+        a, b = rng.sample(npc_names, 2)
+        trace.append({'t': t, 'payload': {'starterAndAction': f"{a} {rng.choice(ACTIONS)} {b}"}})
+    return trace
+
+
+def load_trace(path, rate=None):
+    """JSONL trace: {"t": seconds from start, "payload": {...}} or bare payloads (spaced at `rate`)."""
+    trace = []
+    with open(path, encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if 'payload' not in obj:
+                obj = {'t': i / (rate or 1.0), 'payload': obj}
+            trace.append(obj)
+    return trace
+
+
+def synthetic_world(npcs, per_npc, seed=3):
+    rng = random.Random(seed)
+    names = [bench_relations.npc_name(i).capitalize() for i in range(npcs)]
+    npc_map = {}
+    for name in names:
+        npc_map[name] = {t: {'Attitude': rng.choice(bench_relations.ATTITUDES),
+                             'AttitudeScore': rng.randint(-100, 100),
+                             'relation': rng.choice(bench_relations.RELATIONS)}
+                         for t in rng.sample(names, min(per_npc, npcs)) if t != name}
+    return relationStore.RelationStore.from_map(npc_map), names
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource  # peak, not current, but the best we have off Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def encode_line(obj):
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+async def open_client(host, port, framing=None):
+    """Connect like a UE client; `framing` is None (newline JSON) or a frames hello dict."""
+    reader, writer = await asyncio.open_connection(host, port)
+    if not framing:
+        return reader, writer, eventServer.MessageFramer(), encode_line
+    writer.write(json.dumps(dict({'protocol': wireProtocol.PROTOCOL}, **framing)).encode('utf-8') + b'\n')
+    answer = json.loads(await reader.readline())
+    codec = wireProtocol.FrameCodec(answer['codec'], answer['compress'])
+    return reader, writer, wireProtocol.FrameDecoder(codec), codec.encode
+
+
+async def ue_client(host, port, events, speedup, results, stream, framing=None):
+    """One fake UE client replaying `events` on their timestamps (open loop)."""
+    reader, writer, decoder, encode = await open_client(host, port, framing)
+    pending = {}
+    start = time.perf_counter()
+
+    async def receive():
+        while pending or not sending_done.is_set():
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            for msg in decoder.feed(chunk):
+                handle(json.loads(msg) if isinstance(msg, str) else msg)
+
+    def handle(msg):
+        event_id = msg.get('eventId') if isinstance(msg, dict) else None
+        if event_id not in pending:
+            return
+        now = time.perf_counter()
+        entry = pending[event_id]
+        if 'record' in msg and 'first' not in entry:
+            entry['first'] = now - entry['sent']
+        if msg.get('type') in ('dropped', 'busy'):
+            entry['error'] = msg.get('reason') or msg['type']
+            results.append(pending.pop(event_id))
+        elif 'records' in msg or msg.get('done'):
+            entry['latency'] = now - entry['sent']
+            entry.setdefault('first', entry['latency'])
+            results.append(pending.pop(event_id))
+
+    sending_done = asyncio.Event()
+    receiver = asyncio.ensure_future(receive())
+    for event_id, ev in events:
+        delay = start + ev['t'] / speedup - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        payload = dict(ev['payload'], eventId=event_id)
+        if stream:
+            payload['stream'] = True
+        pending[event_id] = {'eventId': event_id, 'sent': time.perf_counter()}
+        writer.write(encode(payload))
+        await writer.drain()
+    sending_done.set()
+    try:
+        await asyncio.wait_for(receiver, timeout=120)
+    except asyncio.TimeoutError:
+        receiver.cancel()
+    results.extend({'eventId': k, 'error': 'timeout'} for k in pending)
+    writer.close()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(results, wall, mem_before, mem_after):
+    ok = [r for r in results if 'latency' in r]
+    lat = [r['latency'] for r in ok]
+    first = [r['first'] for r in ok]
+    return {
+        'events': len(results), 'completed': len(ok), 'errors': len(results) - len(ok),
+        'wall_seconds': wall, 'events_per_second': len(ok) / wall if wall else 0.0,
+        'latency_p50': percentile(lat, 50), 'latency_p95': percentile(lat, 95),
+        'latency_p99': percentile(lat, 99), 'latency_mean': statistics.mean(lat) if lat else None,
+        'first_record_p50': percentile(first, 50), 'first_record_p95': percentile(first, 95),
+        'memory_start_bytes': mem_before, 'memory_end_bytes': mem_after,
+        'memory_growth_bytes': None if mem_before is None else mem_after - mem_before,
+    }
+
+
+def compare(report, previous, threshold=0.10):
+    print(f"Compared with {previous['saved_at']} ({previous['label']}):")
+    regressions = []
+    for key, higher_is_worse in (('latency_p50', True), ('latency_p95', True), ('latency_p99', True),
+                                 ('events_per_second', False), ('memory_growth_bytes', True)):
+        old, new = previous['summary'].get(key), report['summary'].get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / abs(old)
+        worse = change > threshold if higher_is_worse else change < -threshold
+        print(f"  {key:22s} {old:12.4g} -> {new:12.4g}  ({change:+.1%}){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+async def run(args):
+    trace_world = None
+    if not args.external:
+        store, names = synthetic_world(args.npcs, args.relations_per_npc)
+        log_dir = tempfile.mkdtemp(prefix='bench_log_')
+        world = Backend.World(store, changeLog.ChangeLog(log_dir))
+        pool = crawlerPool.CrawlerPool([
+            llmBackend.FakeLLMBackend(lambda: list(store), Backend.FAKE_FIRST_TOKEN, Backend.FAKE_TOTAL,
+                                      name=f"fake{i}", time_scale=args.llm_time_scale)
+            for i in range(args.llm_sessions)])
+        Backend.HOST, Backend.PORT = args.host, args.port
+        Backend.TRACE_LOG_PATH = args.trace_log
+        # memory-only, so runs don't warm each other up through the disk tier
+        cache = responseCache.ResponseCache(Backend.CACHE_MAX_ENTRIES, Backend.CACHE_TTL, None) \
+            if args.cache else None
+        server = asyncio.ensure_future(Backend.run_async(world, pool, cache))
+        await asyncio.sleep(0.3)
+        trace_world = names
+    else:
+        names = [bench_relations.npc_name(i).capitalize() for i in range(args.npcs)]
+
+    trace = load_trace(args.trace, args.rate) if args.trace else synthetic_trace(args.events, names, args.rate)
+    if args.save_trace:
+        with open(args.save_trace, 'w', encoding='utf-8') as f:
+            for ev in trace:
+                f.write(json.dumps(ev, ensure_ascii=False) + '\n')
+
+    # round-robin the trace over the clients, keeping timestamps
+    per_client = [[] for _ in range(args.clients)]
+    for i, ev in enumerate(trace):
+        per_client[i % args.clients].append((i, ev))
+
+    mem_before = rss_bytes() if trace_world else None
+    if trace_world and args.tracemalloc:
+        tracemalloc.start()
+    results = []
+    start = time.perf_counter()
+    framing = None
+    if args.framing == 'frames':
+        framing = {'codecs': [args.codec], 'compress': ['zlib'] if args.compress else []}
+    await asyncio.gather(*(ue_client(args.host, args.port, evs, args.speedup, results, args.stream, framing)
+                           for evs in per_client))
+    wall = time.perf_counter() - start
+    mem_after = rss_bytes() if trace_world else None
+    summary = summarize(results, wall, mem_before, mem_after)
+    if trace_world and args.tracemalloc:
+        summary['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if not args.external:
+        print(metrics.REGISTRY.summary())
+        server.cancel()
+        try:
+            await server
+        except asyncio.CancelledError:
+            pass
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark: fake UE clients -> backend -> LLM")
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--external', action='store_true',
+                        help="drive an already running backend instead of starting one with the stand-in LLM")
+    parser.add_argument('--trace', help="JSONL trace to replay (default: synthetic)")
+    parser.add_argument('--save-trace', help="write the trace that was replayed")
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=5.0, help="events per second in the synthetic trace")
+    parser.add_argument('--speedup', type=float, default=1.0, help="replay the trace this many times faster")
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--framing', choices=['lines', 'frames'], default='lines',
+                        help="newline JSON or negotiated length-prefixed frames")
+    parser.add_argument('--codec', choices=['json', 'msgpack'], default='msgpack',
+                        help="frame codec to ask for (falls back to json if the server lacks msgpack)")
+    parser.add_argument('--compress', action='store_true', help="allow zlib for large frames")
+    parser.add_argument('--cache', action='store_true', help="enable the response cache")
+    parser.add_argument('--npcs', type=int, default=200)
+    parser.add_argument('--relations-per-npc', type=int, default=10)
+    parser.add_argument('--llm-sessions', type=int, default=4)
+    parser.add_argument('--llm-time-scale', type=float, default=1.0, help="scale the stand-in LLM latencies")
+    parser.add_argument('--tracemalloc', action='store_true')
+    parser.add_argument('--trace-log', help="write the backend's per-turn stage timings here")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--baseline', help="result file to compare with (default: the last run with this label)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help="exit non-zero when a metric is more than 10%% worse than the baseline")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    report = {'label': args.label, 'saved_at': datetime.now().isoformat(timespec='seconds'),
+              'args': vars(args), 'summary': summary}
+    for key, value in summary.items():
+        print(f"  {key:24s} {value}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    previous = [args.baseline] if args.baseline else \
+        sorted(glob.glob(os.path.join(args.results_dir, f"*-{args.label}.json")))
+    path = os.path.join(args.results_dir, datetime.now().strftime('%Y%m%d-%H%M%S') + f"-{args.label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {path}")
+    if previous:
+        with open(previous[-1], encoding='utf-8') as f:
+            regressions = compare(report, json.load(f))
+        if regressions and args.fail_on_regression:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
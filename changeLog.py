@@ -0,0 +1,184 @@
+import json
+import os
+import time
+from collections import deque
+
+SEGMENT_PREFIX = 'changes-'
+SEGMENT_SUFFIX = '.jsonl'
+
+
+def list_segments(directory):
+    names = [n for n in os.listdir(directory)
+             if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+    return [os.path.join(directory, n) for n in sorted(names)]
+
+
+def read_segment(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn write
+
+
+def first_seq(path):
+    """The seq of a segment's first record; None if it has none (or is gone)."""
+    try:
+        for record in read_segment(path):
+            return record.get('seq')
+    except FileNotFoundError:
+        pass
+    return None
+
+
+class LogSnapshot:
+    """
+    A log's records up to `until_seq`, read back from its segment files.
+    Picklable, so a job thread or process can iterate it while the log keeps
+    growing (or gets compacted) underneath.
+    """
+
+    def __init__(self, directory, until_seq):
+        self.directory = directory
+        self.until_seq = until_seq
+
+    def __iter__(self):
+        for path in list_segments(self.directory):
+            try:
+                for record in read_segment(path):
+                    if record.get('seq', 0) > self.until_seq:
+                        return
+                    yield record
+            except FileNotFoundError:
+                continue  # compacted away meanwhile
+
+    def __len__(self):
+        return self.until_seq
+
+
+class ChangeLog:
+    """
+    Append-only change history on disk, one JSON record per line.
+
+    Records get a monotonically increasing `seq` and are written as soon as
+    they are appended; fsync is batched (every `fsync_every` records or
+    `fsync_interval` seconds, whichever comes first). Segments roll over at
+    `segment_bytes`. Only the last `tail` records are kept in memory.
+
+    It behaves enough like the old `changes` list for
+    `update_npc_map_with_messages` (append) and `store_change_history`
+    (iteration reads back every segment).
+    """
+
+    def __init__(self, directory, segment_bytes=16 << 20, fsync_every=32, fsync_interval=1.0, tail=500):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.tail = deque(maxlen=tail)
+        self.seq = 0
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._resume()
+
+    def segments(self):
+        return list_segments(self.directory)
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+
+    @staticmethod
+    def _segment_index(path):
+        return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+    def _resume(self):
+        segments = self.segments()
+        if not segments:
+            self._open(self._segment_path(1))
+            return
+        last = segments[-1]
+        # a crash can leave half a line at the end; cut it off
+        with open(last, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+        for path in reversed(segments):
+            # the newest segment may be empty right after a rotation
+            records = list(read_segment(path))
+            if records:
+                self.seq = records[-1]['seq']
+                self.tail.extend(records)
+                break
+        self._open(last)
+
+    def _open(self, path):
+        if self._file:
+            self.sync()
+            self._file.close()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        self.seq += 1
+        record = dict(record, seq=self.seq)
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()  # in the OS as soon as it is appended; fsync is batched
+        self._unsynced += 1
+        self.tail.append(record)
+        if (self._unsynced >= self.fsync_every or
+                time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+        if self._file.tell() >= self.segment_bytes:
+            self._open(self._segment_path(self._segment_index(self._file.name) + 1))
+        return self.seq
+
+    def sync(self):
+        if self._file and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def records(self, since_seq=0):
+        """Every record with seq > since_seq, oldest first; from the tail when it covers them."""
+        if self._file:
+            self._file.flush()
+        if self.tail and since_seq >= self.tail[0]['seq'] - 1:
+            yield from (r for r in list(self.tail) if r['seq'] > since_seq)
+            return
+        segments = self.segments()
+        # start at the newest segment that begins at or before since_seq + 1
+        start = 0
+        for i in range(len(segments) - 1, 0, -1):
+            first = first_seq(segments[i])
+            if first is not None and first <= since_seq + 1:
+                start = i
+                break
+        for path in segments[start:]:
+            try:
+                for record in read_segment(path):
+                    if record.get('seq', 0) > since_seq:
+                        yield record
+            except FileNotFoundError:
+                continue  # compacted away meanwhile
+
+    def __iter__(self):
+        return self.records()
+
+    def snapshot(self):
+        """Everything appended so far, for reading off the event loop."""
+        if self._file:
+            self._file.flush()
+        return LogSnapshot(self.directory, self.seq)
+
+    def __len__(self):
+        return self.seq
+
+    def close(self):
+        if self._file:
+            self.sync()
+            self._file.close()
+            self._file = None
@@ -6,72 +6,279 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import pyperclip
-from selenium.webdriver.common.action_chains import ActionChains
+from collections import deque
+from contextlib import contextmanager
+import threading
 import time
 import os
 import json
 from datetime import datetime
 
-class ChatBotCrawler:
-    def __init__(self):
-        chrome_options = Options()
-        chrome_options.debugger_address = "127.0.0.1:9223"
-
-        chrome_service = Service("Z://bussiness//pycharmProjects//9636NetSenProj//chromedriver-win64//chromedriver.exe",
-                                 log_path="chromedriver.log",
-                                 verbose=True
-                                 )
-        driver = webdriver.Chrome(service=chrome_service, options=chrome_options)
-        try:
-            driver.execute_script("""
-                try {
-                    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                } catch(e) {}
-            """)
-        except Exception:
-            pass  # Ignore the error
-        self.driver = driver
+import metrics
+from llmBackend import LLMBackend
+
+CHAT_URL = "https://chatgpt.com/"
+CHROMEDRIVER_PATH = "Z://bussiness//pycharmProjects//9636NetSenProj//chromedriver-win64//chromedriver.exe"
+
+# Types the prompt into the ProseMirror editor through the page itself, so
+# several sessions never go through the one OS clipboard.
+INJECT_TEXT_JS = """
+const box = arguments[0], lines = arguments[1].split('\\n');
+box.focus();
+const sel = window.getSelection();
+sel.selectAllChildren(box);
+sel.collapseToEnd();
+lines.forEach((line, i) => {
+    if (i > 0) document.execCommand('insertParagraph');
+    if (line) document.execCommand('insertText', false, line);
+});
+return box.innerText.trim().length > 0;
+"""
+
+# Resolves as soon as the reply in `block` is finished: the page's stop button
+# is gone and the reply has text. A MutationObserver re-checks on every DOM
+# change instead of us polling over WebDriver. Each call waits at most
+# `sliceMs`, so a tab sharing its driver with others only holds it briefly.
+# When `lastText` is a string the call also resolves as soon as the reply text
+# differs from it, which is how partial replies are streamed.
+WAIT_COMPLETE_JS = """
+const block = arguments[0], sliceMs = arguments[1], lastText = arguments[2];
+const done = arguments[arguments.length - 1];
+const STOP = 'button[data-testid="stop-button"]';
+const textOf = () => { const p = block.querySelector('.markdown p'); return p ? p.innerText : ''; };
+const finished = () => !document.querySelector(STOP) && textOf().length > 0;
+let settled = false, obs = null, timer = null;
+const finish = () => {
+    if (settled) return;
+    settled = true;
+    if (obs) obs.disconnect();
+    clearTimeout(timer);
+    done({complete: finished(), text: textOf()});
+};
+if (finished()) { finish(); return; }
+const changed = () => typeof lastText === 'string' && textOf() !== lastText;
+if (changed()) { finish(); return; }
+obs = new MutationObserver(() => { if (finished() || changed()) finish(); });
+obs.observe(document.body, {childList: true, subtree: true, characterData: true});
+timer = setTimeout(finish, sliceMs);
+"""
+
+
+# Newest message block without handing every block back over WebDriver. After
+# the first full lookup the turn container is remembered and walked from its
+# last child backwards, so the cost no longer grows with the chat length.
+LAST_BLOCK_JS = """
+const css = arguments[0];
+let box = window.__npcTurnBox;
+if (box && box.isConnected) {
+    for (let el = box.lastElementChild; el; el = el.previousElementSibling) {
+        if (el.matches(css)) return el;
+        const found = el.querySelectorAll(css);
+        if (found.length) return found[found.length - 1];
+    }
+}
+const all = document.querySelectorAll(css);
+if (!all.length) return null;
+const last = all[all.length - 1];
+const turn = last.closest('article') || last;
+window.__npcTurnBox = turn.parentElement;
+return last;
+"""
+
+
+def attach_driver(debugger_address):
+    chrome_options = Options()
+    chrome_options.debugger_address = debugger_address
+
+    chrome_service = Service(CHROMEDRIVER_PATH,
+                             log_path="chromedriver.log",
+                             verbose=True
+                             )
+    driver = webdriver.Chrome(service=chrome_service, options=chrome_options)
+    try:
+        driver.execute_script("""
+            try {
+                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+            } catch(e) {}
+        """)
+    except Exception:
+        pass  # Ignore the error
+    return driver
+
+
+class SharedDriver:
+    """
+    One chromedriver session. Several tabs of the same Chrome can share it;
+    WebDriver only talks to one window at a time, so every call goes through
+    `focus()`, which holds the lock and switches to the caller's tab.
+    """
+
+    def __init__(self, debugger_address="127.0.0.1:9223", driver=None):
+        self.debugger_address = debugger_address
+        self.driver = driver or attach_driver(debugger_address)
+        self.lock = threading.RLock()
+        self.active_handle = None
+        self.driver.set_script_timeout(30)
+
+    @contextmanager
+    def focus(self, window_handle=None):
+        with self.lock:
+            if window_handle and window_handle != self.active_handle:
+                self.driver.switch_to.window(window_handle)
+                self.active_handle = window_handle
+            yield self.driver
+
+
+class ChatBotCrawler(LLMBackend):
+    def __init__(self, debugger_address="127.0.0.1:9223", shared=None, window_handle=None, name=None):
+        self.shared = shared or SharedDriver(debugger_address)
+        self.driver = self.shared.driver
+        self.window_handle = window_handle
+        self.name = name or (window_handle or self.shared.debugger_address)
         self.msg_css = 'div.flex.w-full.flex-col.gap-1.empty\\:hidden.first\\:pt-\\[3px\\]'
         self.input_css = "div.ProseMirror#prompt-textarea"
+        # set to False to always use the settle-time poll
+        self.use_completion_detector = True
+        # {'method': 'observer' | 'settle', 'seconds': float} for the last turn
+        self.last_wait = None
+        self.wait_history = deque(maxlen=200)
+        # chat rotation: start a fresh chat after `rotate_after_turns` turns, or
+        # once the mean of the last `latency_window` turns exceeds
+        # `rotate_latency` seconds. The new chat is primed with seed_fn().
+        self.rotate_after_turns = None
+        self.rotate_latency = None
+        self.latency_window = 5
+        self.seed_fn = None
+        self.turns = 0
+        self.turn_latency = deque(maxlen=200)
+        self.rotations = 0
+
+    def _focused(self, condition):
+        # wrap an expected condition so each poll runs against our own tab
+        def check(driver):
+            with self.shared.focus(self.window_handle):
+                return condition(driver)
+        return check
+
+    def inject_text(self, input_box, message):
+        if not self.driver.execute_script(INJECT_TEXT_JS, input_box, message):
+            # editor rejected execCommand; fall back to typing
+            for i, line in enumerate(message.split('\n')):
+                if i:
+                    input_box.send_keys(Keys.SHIFT, Keys.ENTER)
+                input_box.send_keys(line)
+
+    def last_block(self):
+        with self.shared.focus(self.window_handle):
+            return self.driver.execute_script(LAST_BLOCK_JS, self.msg_css)
+
+    def should_rotate(self):
+        if self.seed_fn is None:
+            return False
+        if self.rotate_after_turns and self.turns >= self.rotate_after_turns:
+            return True
+        recent = list(self.turn_latency)[-self.latency_window:]
+        return bool(self.rotate_latency and len(recent) == self.latency_window and
+                    sum(recent) / len(recent) > self.rotate_latency)
 
-    def send_message(self, message):
-        # Find input and focus/send message
-        input_box = self.driver.find_element(By.CSS_SELECTOR, self.input_css)
-        pyperclip.copy(message)  # Your message, with \n
-        input_box.click()
-        ActionChains(self.driver).key_down(Keys.CONTROL).send_keys('v').key_up(Keys.CONTROL).perform()
-        input_box.send_keys(Keys.ENTER)
+    def new_chat(self, seed=None):
+        """Open a fresh chat in this tab and prime it with `seed`."""
+        with self.shared.focus(self.window_handle):
+            self.driver.get(CHAT_URL)
+            self.driver.execute_script("window.__npcTurnBox = null;")
+        WebDriverWait(self.driver, 15).until(
+            self._focused(EC.presence_of_element_located((By.CSS_SELECTOR, self.input_css))))
+        if seed:
+            self._send(seed)
+        self.turns = 0
+        self.turn_latency.clear()
+
+    def rotate(self):
+        print(f"{self.name}: rotating to a fresh chat after {self.turns} turns")
+        self.new_chat(self.seed_fn())
+        self.rotations += 1
+
+    def send_message(self, message, on_update=None):
+        """
+        Send `message` and return the full reply text. `on_update(text)`, if
+        given, is called from this thread with every new partial reply.
+        """
+        if self.should_rotate():
+            with metrics.span('rotate'):
+                self.rotate()
+        return self._send(message, on_update)
+
+    def _send(self, message, on_update=None):
+        turn_start = time.perf_counter()
+        with self.shared.focus(self.window_handle), metrics.span('inject'):
+            # Find input and focus/send message
+            input_box = self.driver.find_element(By.CSS_SELECTOR, self.input_css)
+            input_box.click()
+            self.inject_text(input_box, message)
+            input_box.send_keys(Keys.ENTER)
 
         # Wait for new response block
-        blocks = self.driver.find_elements(By.CSS_SELECTOR, self.msg_css)
-        last = blocks[-1]
-        WebDriverWait(self.driver, 10).until(EC.staleness_of(last))
-
-        # Get the latest <p> in new block
-        new_blocks = self.driver.find_elements(By.CSS_SELECTOR, self.msg_css)
-        latest_block  = new_blocks[-1]
-        try:
-            latest_p = WebDriverWait(latest_block, 5).until(
-                lambda el: el.find_element(By.CSS_SELECTOR, '.markdown p')
-            )
-        except Exception:
-            print("Could not find .markdown p in latest block")
-            latest_p = None
+        with metrics.span('reply_start'):
+            last = self.last_block()
+            if last is not None:
+                WebDriverWait(self.driver, 10).until(self._focused(EC.staleness_of(last)))
+            latest_block = WebDriverWait(self.driver, 10).until(lambda d: self.last_block())
 
         # Wait for typing effect to finish
-        return self.wait_for_stable_text(latest_p)
+        start = time.perf_counter()
+        text, method = None, 'observer'
+        if self.use_completion_detector:
+            try:
+                text = self.wait_for_completion(latest_block, on_update=on_update)
+            except Exception as e:
+                print(f"Completion detector failed ({e!r}), falling back to settle polling")
+        if text is None:
+            method = 'settle'
+            try:
+                latest_p = WebDriverWait(latest_block, 5).until(
+                    self._focused(lambda el: el.find_element(By.CSS_SELECTOR, '.markdown p'))
+                )
+            except Exception:
+                print("Could not find .markdown p in latest block")
+                latest_p = None
+            text = self.wait_for_stable_text(latest_p, on_update=on_update)
+        self.last_wait = {'method': method, 'seconds': time.perf_counter() - start}
+        metrics.record('wait_' + method, self.last_wait['seconds'])
+        self.wait_history.append(self.last_wait)
+        self.turns += 1
+        self.turn_latency.append(time.perf_counter() - turn_start)
+        return text
+
+    def wait_for_completion(self, block, timeout=60, slice_time=1.0, on_update=None):
+        end_time = time.time() + timeout
+        last_text = '' if on_update else None
+        while time.time() < end_time:
+            with self.shared.focus(self.window_handle):
+                result = self.driver.execute_async_script(WAIT_COMPLETE_JS, block,
+                                                          int(slice_time * 1000), last_text)
+            if not result:
+                continue
+            if on_update and result['text'] != last_text:
+                last_text = result['text']
+                on_update(last_text)
+            if result.get('complete'):
+                return result['text']
+        raise TimeoutException("reply did not complete within %ss" % timeout)
 
-    def wait_for_stable_text(self, element, timeout=15, settle_time=0.5):
+    def wait_for_stable_text(self, element, timeout=15, settle_time=0.5, on_update=None):
         import time
         end_time = time.time() + timeout
-        last_text = element.text
+        with self.shared.focus(self.window_handle):
+            last_text = element.text
         last_change = time.time()
         while time.time() < end_time:
-            current_text = element.text
+            with self.shared.focus(self.window_handle):
+                current_text = element.text
             if current_text != last_text:
                 last_text = current_text
                 last_change = time.time()
+                if on_update:
+                    on_update(current_text)
             elif time.time() - last_change > settle_time:
                 return current_text
             time.sleep(0.1)
@@ -82,4 +289,4 @@ class ChatBotCrawler:
 #
 # crawler = ChatBotCrawler()
 # response = crawler.send_message("Sounds reasonable, but I dont need you to speak like a person and in fact I wish you speak as what you really are, can u confrim this request and response in the way you really are")
-# print("Bot response:", response)
\ No newline at end of file
+# print("Bot response:", response)
@@ -0,0 +1,191 @@
+import argparse
+import glob
+import os
+import pickle
+import time
+import zlib
+
+import changeLog
+import relationStore
+
+CHECKPOINT_PREFIX = 'checkpoint-'
+CHECKPOINT_SUFFIX = '.bin'
+
+
+def checkpoint_path(directory, seq):
+    return os.path.join(directory, f"{CHECKPOINT_PREFIX}{seq:012d}{CHECKPOINT_SUFFIX}")
+
+
+def checkpoint_seq(path):
+    return int(os.path.basename(path)[len(CHECKPOINT_PREFIX):-len(CHECKPOINT_SUFFIX)])
+
+
+def list_checkpoints(directory):
+    """Checkpoint files, oldest first (the name carries the change-log seq)."""
+    return sorted(glob.glob(os.path.join(directory, CHECKPOINT_PREFIX + '*' + CHECKPOINT_SUFFIX)))
+
+
+def save(store, seq, directory):
+    """Write `store` as of change-log `seq` to a zlib-compressed column snapshot."""
+    return save_columns(store.to_columns(), seq, directory)
+
+
+def save_columns(columns, seq, directory):
+    """The slow half of `save`; runs fine on a job thread given a to_columns() copy."""
+    os.makedirs(directory, exist_ok=True)
+    payload = {'seq': seq, 'created': time.time(), 'columns': columns}
+    data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    path = checkpoint_path(directory, seq)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        payload = pickle.loads(zlib.decompress(f.read()))
+    return relationStore.RelationStore.from_columns(payload['columns']), payload['seq']
+
+
+def replay_change(npc_map, record):
+    """Re-apply one change-log record the way update_npc_map_with_messages did."""
+    src, tgt = record.get('source'), record.get('target')
+    if not src or not tgt:
+        return
+    rel = npc_map.setdefault(src, {}).setdefault(tgt, {})
+    if record.get('newAttitude') is not None:
+        rel['Attitude'] = record['newAttitude']
+    if record.get('newRelation') is not None:
+        rel['relation'] = record['newRelation']
+
+
+def restore(directory, change_log, load_base):
+    """
+    Latest checkpoint plus the change-log records after it. Without a usable
+    checkpoint, `load_base()` (the CSV map) is used and the whole log replayed.
+    Returns (store, replayed_record_count).
+    """
+    start = time.perf_counter()
+    store, seq = None, 0
+    for path in reversed(list_checkpoints(directory)):
+        try:
+            store, seq = load(path)
+            break
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError, KeyError) as e:
+            print(f"Skipping unreadable checkpoint {path}: {e!r}")
+    if store is None:
+        store = relationStore.RelationStore.from_map(load_base())
+
+    replayed = 0
+    for record in change_log.records(since_seq=seq):
+        replay_change(store, record)
+        replayed += 1
+    print(f"Restored NPC map at change {seq} + {replayed} replayed in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    return store, replayed
+
+
+def compact(directory, keep=2, change_log_dir=None):
+    """
+    Delete all but the newest `keep` checkpoints. With `change_log_dir`, also
+    delete log segments that end before the oldest kept checkpoint.
+    """
+    checkpoints = list_checkpoints(directory)
+    removed = checkpoints[:-keep] if keep else checkpoints
+    for path in removed:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # pruned by the Checkpointer's own job meanwhile
+    print(f"Removed {len(removed)} checkpoint(s), kept {len(checkpoints) - len(removed)}")
+
+    kept = list_checkpoints(directory)
+    if change_log_dir and kept:
+        oldest_seq = checkpoint_seq(kept[0])
+        segments = changeLog.list_segments(change_log_dir)
+        dropped = 0
+        # a segment is covered when the next one starts at or before oldest_seq + 1
+        for path, following in zip(segments, segments[1:]):
+            first = changeLog.first_seq(following)
+            if first is None or first > oldest_seq + 1:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue  # already gone
+            dropped += 1
+        print(f"Removed {dropped} change-log segment(s) covered by checkpoints")
+
+
+class Checkpointer:
+    """
+    Takes a checkpoint once `every_records` changes or `every_seconds` have
+    piled up since the last one, which bounds how much a restart replays.
+    Store edits that are not in the change log (score ticks) count toward
+    `every_seconds`.
+    """
+
+    def __init__(self, store, change_log, directory, every_records=500, every_seconds=300, keep=3, jobs=None):
+        self.store = store
+        self.jobs = jobs   # backgroundJobs.JobQueue: write checkpoints off the caller's thread
+        self.change_log = change_log
+        self.directory = directory
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.keep = keep
+        existing = list_checkpoints(directory)
+        self.last_seq = checkpoint_seq(existing[-1]) if existing else 0
+        # the store's version also moves without a logged change (ScoreEngine ticks)
+        self.last_version = getattr(store, 'version', 0)
+        self.last_time = time.monotonic()
+
+    def _dirty(self):
+        return self.change_log.seq != self.last_seq or getattr(self.store, 'version', 0) != self.last_version
+
+    def due(self):
+        pending = self.change_log.seq - self.last_seq
+        return pending >= self.every_records or (
+            self._dirty() and time.monotonic() - self.last_time >= self.every_seconds)
+
+    def checkpoint(self, background=True):
+        self.change_log.sync()
+        seq = self.change_log.seq
+        if not self._dirty() and list_checkpoints(self.directory):
+            return  # nothing new since the last one
+        # copying the columns is quick; pickling, compressing and fsync are not
+        version = getattr(self.store, 'version', 0)
+        columns = self.store.to_columns()
+        if background and self.jobs is not None:
+            if not self.jobs.submit(('checkpoint', self.directory), self._write, columns, seq):
+                return  # queue full; due() stays true and we try again
+        else:
+            self._write(columns, seq)
+        self.last_seq, self.last_version, self.last_time = seq, version, time.monotonic()
+
+    def _write(self, columns, seq):
+        save_columns(columns, seq, self.directory)
+        for path in list_checkpoints(self.directory)[:-self.keep]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # pruned by a compaction job meanwhile
+
+    def maybe_checkpoint(self):
+        if self.due():
+            self.checkpoint()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NPC world checkpoint maintenance")
+    sub = parser.add_subparsers(dest='command', required=True)
+    c = sub.add_parser('compact', help="delete old checkpoints")
+    c.add_argument('directory')
+    c.add_argument('--keep', type=int, default=2)
+    c.add_argument('--change-log', help="also drop change-log segments older than the kept checkpoints")
+    args = parser.parse_args()
+    if args.command == 'compact':
+        compact(args.directory, args.keep, args.change_log)
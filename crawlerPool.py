@@ -0,0 +1,96 @@
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# text is the raw reply; session is the name of the crawler that produced it;
+# wait is the crawler's last_wait for that turn (completion detector timing)
+PoolResult = namedtuple('PoolResult', ['event_id', 'text', 'session', 'elapsed', 'wait'])
+
+
+class CrawlerPool:
+    """
+    N LLM sessions serving events in parallel: Selenium chat tabs and/or
+    debugger ports, or any other llmBackend.LLMBackend.
+
+    `submit` hands an event to the next idle session and returns a Future of a
+    PoolResult tagged with the caller's event id. At most one turn is in flight
+    per session; everything else waits in the executor queue.
+    """
+
+    def __init__(self, crawlers):
+        if not crawlers:
+            raise ValueError("CrawlerPool needs at least one crawler")
+        self.crawlers = list(crawlers)
+        self.idle = queue.Queue()
+        for crawler in self.crawlers:
+            self.idle.put(crawler)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.crawlers),
+                                           thread_name_prefix="crawler")
+
+    @classmethod
+    def from_tabs(cls, debugger_address="127.0.0.1:9223", tabs=1, seed_prompt=None):
+        """Use `tabs` tabs of one Chrome; missing tabs are opened on a new chat."""
+        import chatClass  # selenium is only needed for real chat sessions
+        shared = chatClass.SharedDriver(debugger_address)
+        handles = list(shared.driver.window_handles)
+        new_handles = []
+        with shared.lock:
+            while len(handles) < tabs:
+                shared.driver.switch_to.new_window('tab')
+                shared.driver.get(chatClass.CHAT_URL)
+                handles.append(shared.driver.current_window_handle)
+                new_handles.append(handles[-1])
+            shared.active_handle = shared.driver.current_window_handle
+
+        crawlers = [chatClass.ChatBotCrawler(shared=shared, window_handle=h, name=f"tab{i}")
+                    for i, h in enumerate(handles[:tabs])]
+        if seed_prompt:
+            for crawler in crawlers:
+                if crawler.window_handle in new_handles:
+                    crawler.send_message(seed_prompt)
+        return cls(crawlers)
+
+    @classmethod
+    def from_ports(cls, debugger_addresses):
+        """One crawler (and chromedriver session) per Chrome debugger address."""
+        import chatClass
+        return cls([chatClass.ChatBotCrawler(debugger_address=a, name=a) for a in debugger_addresses])
+
+    def set_rotation(self, seed_fn, after_turns=None, latency=None, latency_window=5):
+        """Rotate every session to a fresh chat primed with seed_fn() (see ChatBotCrawler)."""
+        for crawler in self.crawlers:
+            crawler.seed_fn = seed_fn
+            crawler.rotate_after_turns = after_turns
+            crawler.rotate_latency = latency
+            crawler.latency_window = latency_window
+
+    @property
+    def size(self):
+        return len(self.crawlers)
+
+    def submit(self, event_id, message, on_update=None, trace=None):
+        # trace: a metrics.TurnTrace that collects the session's stage timings
+        return self.executor.submit(self._run, event_id, message, on_update, trace, time.perf_counter())
+
+    def send_message(self, message, on_update=None):
+        # drop-in for a single ChatBotCrawler
+        return self._run(None, message, on_update).text
+
+    def _run(self, event_id, message, on_update=None, trace=None, submitted=None):
+        crawler = self.idle.get()
+        start = time.perf_counter()
+        if submitted is not None:
+            metrics.record('pool_wait', start - submitted, trace)
+        try:
+            with metrics.use_trace(trace), metrics.span('llm_session'):
+                text = crawler.send_message(message, on_update=on_update)
+            wait = getattr(crawler, 'last_wait', None)
+        finally:
+            self.idle.put(crawler)
+        return PoolResult(event_id, text, crawler.name, time.perf_counter() - start, wait)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
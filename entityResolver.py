@@ -0,0 +1,156 @@
+import json
+import os
+import re
+
+TITLE_WORDS = {'the', 'of', 'a', 'an', 'sir', 'lady', 'lord', 'mr', 'mrs', 'ms', 'old', 'young'}
+SHORT_NAME = 8   # keys shorter than this only fuzzy-match a typo of the same length
+
+
+def name_key(name):
+    """Case-, digit- and punctuation-insensitive lookup key ('Arthur2 ' -> 'arthur')."""
+    return ' '.join(re.findall(r"[^\W\d_]+", name.casefold()))
+
+
+def one_typo(a, b):
+    """Same length and at most one substituted or two swapped neighbouring letters."""
+    if len(a) != len(b):
+        return False
+    diffs = [i for i in range(len(a)) if a[i] != b[i]]
+    return len(diffs) <= 1 or (len(diffs) == 2 and diffs[1] == diffs[0] + 1 and
+                               a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]])
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameResolver:
+    """
+    Maps whatever the LLM calls an NPC ("alex", "Arthur the Adventurer",
+    "Celin2") to one canonical map key. Lookup order: memo of earlier answers,
+    the alias table (exact keys, plus each NPC's given name and epithet while
+    those are unambiguous; "Sir X" and "X the Y" fall back to X, "X's mother"
+    does not), then the closest canonical name by trigram similarity. Short
+    names only match a one-letter typo, so "Alexa" stays apart from "Alex".
+    Names that match nothing become new canonical NPCs (capitalized
+    like before) so later spellings of them resolve too.
+    """
+
+    def __init__(self, names=(), aliases=None, threshold=0.7):
+        self.threshold = threshold
+        self.canonical = set()
+        self.aliases = {}        # key -> canonical name
+        self.full_keys = set()   # keys that are some NPC's whole name; those always win
+        self.ambiguous = set()   # short keys shared by several NPCs
+        self.grams = {}          # trigram -> set of canonical names
+        self.gram_counts = {}    # canonical name -> number of trigrams
+        self.keys = {}           # canonical name -> its name_key
+        self.memo = {}           # raw spelling -> canonical name
+        self.hits = {'memo': 0, 'alias': 0, 'fuzzy': 0, 'new': 0}
+        for name in names:
+            self.add(name)
+        for alias, name in (aliases or {}).items():
+            self.add(name)
+            self.aliases[name_key(alias)] = name
+
+    @classmethod
+    def from_map(cls, npc_map, alias_path=None, **kwargs):
+        """Seed from every NPC in the map (its CSV IDs) and an optional {alias: name} JSON file."""
+        names = set(npc_map)
+        for src in npc_map:
+            names.update(npc_map[src])
+        aliases = None
+        if alias_path and os.path.exists(alias_path):
+            with open(alias_path, encoding='utf-8') as f:
+                aliases = json.load(f)
+        return cls(sorted(names), aliases, **kwargs)
+
+    def add(self, name):
+        if name in self.canonical:
+            return
+        self.canonical.add(name)
+        key = name_key(name)
+        if not key:
+            return
+        if key not in self.full_keys:
+            self.full_keys.add(key)
+            self.aliases[key] = name
+        words = key.split()
+        # "arthur the adventurer" is also "arthur" and "adventurer", unless another NPC is too
+        short = [w for w in words if w not in TITLE_WORDS][:1]
+        if ' the ' in f" {key} ":
+            short.append(key.split(' the ', 1)[1])
+        for alias in short:
+            if alias in self.full_keys or alias in self.ambiguous:
+                continue
+            owner = self.aliases.get(alias)
+            if owner is None:
+                self.aliases[alias] = name
+            elif owner != name:
+                del self.aliases[alias]
+                self.ambiguous.add(alias)
+                self.memo.clear()  # earlier answers may have gone through this alias
+        grams = trigrams(key)
+        self.gram_counts[name] = len(grams)
+        self.keys[name] = key
+        for g in grams:
+            self.grams.setdefault(g, set()).add(name)
+
+    def closest(self, key):
+        """Best canonical name by Dice similarity of trigram sets, or None under the threshold."""
+        grams = trigrams(key)
+        shared = {}
+        for g in grams:
+            for name in self.grams.get(g, ()):
+                shared[name] = shared.get(name, 0) + 1
+        best, best_score = None, self.threshold
+        for name, n in shared.items():
+            score = 2 * n / (len(grams) + self.gram_counts[name])
+            if score < best_score:
+                continue
+            other = self.keys[name]
+            if min(len(key), len(other)) < SHORT_NAME and not one_typo(key, other):
+                continue   # a few shared trigrams say little about short names
+            best, best_score = name, score
+        return best
+
+    def lookup(self, raw):
+        """Canonical name for `raw`, or None; never adds an NPC."""
+        name = self.memo.get(raw)
+        if name is not None:
+            self.hits['memo'] += 1
+            return name
+        key = name_key(raw)
+        name = self.aliases.get(key)
+        if name is None:
+            # "Sir Arthur" or "Arthur the Brave" is Arthur; "Celin's mother" is someone else
+            head = key.split(' the ', 1)[0] if ' the ' in key else key
+            words = [w for w in head.split() if w not in TITLE_WORDS]
+            if len(words) == 1 and words[0] not in self.ambiguous:
+                name = self.aliases.get(words[0])
+        if name is not None:
+            self.hits['alias'] += 1
+        elif key:
+            name = self.closest(key)
+            if name is not None:
+                self.hits['fuzzy'] += 1
+        if name is not None:
+            self.memo[raw] = name
+        return name
+
+    def resolve(self, raw):
+        """Canonical name for `raw`, registering it as a new NPC when nothing matches."""
+        name = self.lookup(raw)
+        if name is None:
+            name = raw.strip().capitalize()
+            self.add(name)
+            self.memo[raw] = name
+            self.hits['new'] += 1
+        return name
+
+    def normalize(self, raw):
+        """For queries and subscriptions: like resolve, but unknown names are not added."""
+        return self.lookup(raw) or raw.strip().capitalize()
+
+    __call__ = resolve
@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import json
+
+BATCH_INSTRUCTIONS = (
+    "Several game events happened at the same time. React to each one exactly as you would "
+    "to a single event and reply with ONE JSON array containing the records for all of them. "
+    "Every record must include the \"batchEventId\" of the event it reacts to."
+)
+
+
+def build_batch_prompt(batch):
+    """`batch` is a list of (batch_id, event payload dict)."""
+    events = [dict(data, batchEventId=batch_id) for batch_id, data in batch]
+    return json.dumps({'instructions': BATCH_INSTRUCTIONS, 'events': events}, ensure_ascii=False)
+
+
+def split_batch_reply(reply, batch_ids):
+    """
+    Split a combined reply into {batch_id: [records]}. Accepts either a flat
+    array of records tagged with batchEventId or an object keyed by batch id.
+    Untagged records are only kept when there is a single event to give them to.
+    """
+    obj = json.loads(reply)
+    out = {batch_id: [] for batch_id in batch_ids}
+    if isinstance(obj, dict):
+        for batch_id, records in obj.items():
+            if batch_id in out and isinstance(records, list):
+                out[batch_id].extend(records)
+        return out
+
+    for record in obj:
+        if not isinstance(record, dict):
+            continue
+        record = dict(record)
+        batch_id = record.pop('batchEventId', None)
+        if batch_id in out:
+            out[batch_id].append(record)
+        elif len(batch_ids) == 1:
+            out[batch_ids[0]].append(record)
+        else:
+            print(f"Dropping batch record without a known batchEventId: {record}")
+    return out
+
+
+class MicroBatcher:
+    """
+    Collects events arriving within `window` seconds (or up to `max_batch`)
+    and sends them as one prompt through `dispatch`, a coroutine taking the
+    prompt text and returning the reply text. Each `submit` resolves to that
+    event's own record list. A batch of one is sent unchanged.
+    """
+
+    def __init__(self, dispatch, window=0.05, max_batch=8):
+        self.dispatch = dispatch
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self._timer = None
+        self._ids = itertools.count(1)
+        self.batches = self.events = 0
+
+    async def submit(self, msg, data):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((f"b{next(self._ids)}", msg, data, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.events += len(batch)
+        try:
+            if len(batch) == 1:
+                _, msg, _, future = batch[0]
+                reply = await self.dispatch(msg)
+                results = {batch[0][0]: json.loads(reply)}
+            else:
+                prompt = build_batch_prompt([(batch_id, data) for batch_id, _, data, _ in batch])
+                reply = await self.dispatch(prompt)
+                results = split_batch_reply(reply, [batch_id for batch_id, _, _, _ in batch])
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for batch_id, _, _, future in batch:
+            if not future.done():
+                future.set_result(results.get(batch_id, []))
@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+
+PRIORITIES = {'player': 0, 'high': 1, 'normal': 2, 'background': 3}
+# longest an event of each class may wait for the LLM (seconds); None waits forever
+DEFAULT_DEADLINES = {'player': None, 'high': None, 'normal': None, 'background': 8.0}
+
+
+class Dropped(Exception):
+    """The event will not be sent to the LLM: 'stale', 'merged', 'shed' or 'busy'."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def classify(data, player_names=('Player',)):
+    """Priority class of an event: the client's "priority" field, else derived from the payload."""
+    priority = data.get('priority')
+    if priority in PRIORITIES:
+        return priority
+    if isinstance(priority, int):
+        return min(PRIORITIES, key=lambda c: abs(PRIORITIES[c] - priority))
+    text = data.get('starterAndAction') or ''
+    if data.get('playerInvolved') or any(name in text.split() for name in player_names):
+        return 'player'
+    if data.get('ambient') or data.get('gossip'):
+        return 'background'
+    return 'normal'
+
+
+class Ticket:
+    __slots__ = ('rank', 'deadline', 'seq', 'merge_key', 'future', 'priority')
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class PriorityScheduler:
+    """
+    Admits events to the LLM `slots` at a time, highest priority class first
+    and oldest first within a class. While they wait:
+
+    - an event past its deadline is dropped instead of sent (by default only
+      background events have one; others set their own "deadline");
+    - a newer event with the same merge key replaces the queued one;
+    - at most `max_queue` events wait. A new event that does not fit pushes
+      out the lowest-priority waiting one if it outranks it, else it is
+      refused as 'busy'.
+
+    `on_pressure(paused, depth)` is called when the queue crosses the high
+    watermark and again when it drains below the low one, so clients can
+    hold back their background traffic.
+    """
+
+    def __init__(self, slots, max_queue=64, deadlines=None, high_water=0.75, low_water=0.25,
+                 on_pressure=None):
+        self.slots = slots
+        self.free = slots
+        self.max_queue = max_queue
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.high_water = max(1, int(max_queue * high_water))
+        self.low_water = int(max_queue * low_water)
+        self.on_pressure = on_pressure
+        self.paused = False
+        self.heap = []
+        self.waiting = 0
+        self.merge_index = {}
+        self._seq = itertools.count()
+        self.stats = {'admitted': 0, 'stale': 0, 'merged': 0, 'shed': 0, 'busy': 0}
+
+    async def acquire(self, priority='normal', deadline=None, merge_key=None):
+        """Wait for an LLM slot; raises Dropped if the event should not be sent after all."""
+        loop = asyncio.get_running_loop()
+        if self.free > 0 and not self.waiting:
+            self.free -= 1
+            self.stats['admitted'] += 1
+            return
+        if deadline is None and self.deadlines.get(priority) is not None:
+            deadline = self.deadlines[priority]
+
+        ticket = Ticket()
+        ticket.priority = priority
+        ticket.rank = PRIORITIES.get(priority, PRIORITIES['normal'])
+        ticket.deadline = loop.time() + deadline if deadline is not None else None
+        ticket.seq = next(self._seq)
+        ticket.merge_key = merge_key
+        ticket.future = loop.create_future()
+
+        if merge_key is not None:
+            older = self.merge_index.get(merge_key)
+            if older is not None:
+                self._drop(older, 'merged')
+            self.merge_index[merge_key] = ticket
+        if self.waiting >= self.max_queue:
+            self._expire(loop.time())
+        if self.waiting >= self.max_queue:
+            lowest = max((t for t in self.heap if not t.future.done()), default=None)
+            if lowest is None or lowest.rank <= ticket.rank:
+                self._forget(ticket)
+                self.stats['busy'] += 1
+                raise Dropped('busy', retry_after=self.deadlines.get('background') or 1.0)
+            self._drop(lowest, 'shed')
+
+        heapq.heappush(self.heap, ticket)
+        self.waiting += 1
+        self._pressure()
+        try:
+            await ticket.future   # Dropped is raised here for stale/merged/shed tickets
+        except asyncio.CancelledError:
+            if ticket.future.cancelled():
+                # the waiting caller went away (client disconnect, shutdown)
+                self.waiting -= 1
+                self._forget(ticket)
+                self._pressure()
+            elif ticket.future.exception() is None:
+                self.release()   # admitted just as it was cancelled
+            raise
+
+    def release(self):
+        self.free += 1
+        self._admit()
+
+    def _expire(self, now):
+        for ticket in self.heap:
+            if ticket.deadline is not None and now > ticket.deadline:
+                self._drop(ticket, 'stale')
+
+    def _admit(self):
+        loop = asyncio.get_running_loop()
+        while self.free > 0 and self.heap:
+            ticket = heapq.heappop(self.heap)
+            if ticket.future.done():
+                continue   # merged, shed or cancelled while waiting
+            self.waiting -= 1
+            self._forget(ticket)
+            if ticket.deadline is not None and loop.time() > ticket.deadline:
+                self.stats['stale'] += 1
+                ticket.future.set_exception(Dropped('stale'))
+                continue
+            self.free -= 1
+            self.stats['admitted'] += 1
+            ticket.future.set_result(None)
+        self._pressure()
+
+    def _drop(self, ticket, reason):
+        if ticket.future.done():
+            return
+        self.waiting -= 1
+        self._forget(ticket)
+        self.stats[reason] += 1
+        ticket.future.set_exception(Dropped(reason))
+
+    def _forget(self, ticket):
+        if ticket.merge_key is not None and self.merge_index.get(ticket.merge_key) is ticket:
+            del self.merge_index[ticket.merge_key]
+
+    def _pressure(self):
+        if not self.paused and self.waiting >= self.high_water:
+            self.paused = True
+        elif self.paused and self.waiting <= self.low_water:
+            self.paused = False
+        else:
+            return
+        if self.on_pressure:
+            self.on_pressure(self.paused, self.waiting)
+
+    async def run(self, coro_fn, priority='normal', deadline=None, merge_key=None):
+        """acquire(), await coro_fn(), release()."""
+        await self.acquire(priority, deadline, merge_key)
+        try:
+            return await coro_fn()
+        finally:
+            self.release()
@@ -0,0 +1,240 @@
+import asyncio
+import json
+
+import wireProtocol
+
+
+class MessageFramer:
+    """
+    Splits the raw byte stream from a game client into JSON message strings.
+    Messages are newline-delimited; a trailing un-terminated JSON object is
+    still accepted so older UE clients that never send '\n' keep working.
+    """
+
+    def __init__(self, max_buffer=1 << 20):
+        self.buffer = b''
+        self.max_buffer = max_buffer
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        messages = []
+
+        # newline-delimited messages
+        while True:
+            idx = self.buffer.find(b'\n')
+            if idx < 0:
+                break
+            line, self.buffer = self.buffer[:idx], self.buffer[idx + 1:]
+            line = line.strip()
+            if line:
+                messages.append(line.decode('utf-8'))
+
+        # legacy clients: one or more complete objects without a terminator
+        if self.buffer.strip():
+            try:
+                text = self.buffer.decode('utf-8')
+            except UnicodeDecodeError:
+                text = None  # split inside a multi-byte character, wait for more
+            while text:
+                text = text.lstrip()
+                if not text.startswith('{'):
+                    break
+                try:
+                    _, end = self._decoder.raw_decode(text)
+                except ValueError:
+                    break  # incomplete, wait for the rest
+                messages.append(text[:end])
+                text = text[end:]
+                self.buffer = text.encode('utf-8')
+
+        if len(self.buffer) > self.max_buffer:
+            raise ValueError("message exceeds %d bytes without a frame boundary" % self.max_buffer)
+        return messages
+
+
+def sniff_hello(buffer):
+    """
+    Look at the first bytes of a connection for a frames hello line.
+    Returns ('wait' | 'legacy' | 'hello', hello dict or None, bytes after the hello).
+    """
+    head = buffer.lstrip()
+    prefix = wireProtocol.HELLO_PREFIX
+    if len(head) < len(prefix) and prefix.startswith(head):
+        return 'wait', None, buffer
+    if not head.startswith(prefix):
+        return 'legacy', None, buffer
+    idx = head.find(b'\n')
+    if idx < 0:
+        return ('wait' if len(head) < 4096 else 'legacy'), None, buffer
+    hello = wireProtocol.is_hello(head[:idx])
+    if hello is None:
+        return 'legacy', None, buffer
+    return 'hello', hello, head[idx + 1:]
+
+
+def _tagged(msg):
+    # newline-JSON messages are still text here; a false match only lets one run concurrently
+    if isinstance(msg, dict):
+        return 'eventId' in msg
+    return isinstance(msg, str) and '"eventId"' in msg
+
+
+class ClientSession:
+    """
+    One connected game client. Replies are newline-delimited JSON unless the
+    client negotiated length-prefixed frames (see wireProtocol).
+    """
+
+    def __init__(self, reader, writer, max_inbox=0):
+        self.reader = reader
+        self.writer = writer
+        self.peer = writer.get_extra_info('peername')
+        # a full inbox stops reading from the socket, which pushes back on the client over TCP
+        self.inbox = asyncio.Queue(max_inbox)
+        self.closed = False
+        self.frames = None   # wireProtocol.FrameCodec once negotiated
+        self.tagged = False  # sent an eventId or priority, so it understands dropped/backpressure notices
+
+    def encode(self, obj):
+        if self.frames is not None:
+            return self.frames.encode(obj)
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n'
+
+    def send_nowait(self, obj):
+        # queue a reply without waiting for the socket buffer to drain
+        if self.closed:
+            return
+        self.writer.write(self.encode(obj))
+
+    async def send(self, obj):
+        if self.closed:
+            return
+        self.send_nowait(obj)
+        await self.writer.drain()
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
+
+
+class EventServer:
+    """
+    asyncio server for UE game clients.
+
+    Every client gets its own session and different clients are handled
+    concurrently. Within a session up to `max_in_flight` messages are handled
+    at once (1 keeps strict arrival order). Messages without an "eventId" are
+    always handled one at a time, since their clients match replies to events
+    by order. `on_message` is a coroutine
+    `(session, msg)` and must push any blocking work (LLM calls) off the event
+    loop itself. `msg` is the JSON text from newline-JSON clients and the
+    already decoded object from clients that negotiated frames. With
+    `max_inbox`, at most that many received messages wait per client before
+    the server stops reading from its socket.
+    """
+
+    def __init__(self, host, port, on_message, on_connect=None, on_disconnect=None, max_in_flight=1,
+                 max_inbox=0):
+        self.host = host
+        self.port = port
+        self.on_message = on_message
+        self.max_in_flight = max_in_flight
+        self.max_inbox = max_inbox
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.sessions = set()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        print(f"Server listening on {self.host}:{self.port}...")
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        for session in list(self.sessions):
+            session.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_client(self, reader, writer):
+        session = ClientSession(reader, writer, self.max_inbox)
+        self.sessions.add(session)
+        print(f"Client connected from {session.peer}")
+        if self.on_connect:
+            await self.on_connect(session)
+
+        worker = asyncio.ensure_future(self._process_inbox(session))
+        framer = MessageFramer()
+        opening = b''   # held back until we know whether the client sent a hello
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                eof = not chunk
+                if opening is not None:
+                    state, hello, chunk = sniff_hello(opening + chunk)
+                    if state == 'wait' and not eof:
+                        opening = chunk
+                        continue
+                    opening = None
+                    if hello is not None:
+                        # the answer is the last newline-JSON line on this connection
+                        answer = wireProtocol.negotiate(hello)
+                        await session.send(answer)
+                        session.frames = wireProtocol.FrameCodec(answer['codec'], answer['compress'])
+                        framer = wireProtocol.FrameDecoder(session.frames)
+                for msg in framer.feed(chunk):
+                    await session.inbox.put(msg)
+                if eof:
+                    break
+        except (ConnectionError, ValueError) as e:
+            print(f"Dropping client {session.peer}: {e}")
+        finally:
+            print(f"Client {session.peer} disconnected.")
+            await session.inbox.put(None)
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass  # server shutting down
+            self.sessions.discard(session)
+            if self.on_disconnect:
+                await self.on_disconnect(session)
+            session.close()
+
+    async def _process_inbox(self, session):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        try:
+            while True:
+                msg = await session.inbox.get()
+                if msg is None:
+                    break
+                tagged = _tagged(msg)
+                if not tagged and pending:
+                    await asyncio.wait(pending)
+                await slots.acquire()
+                task = asyncio.ensure_future(self._dispatch(session, msg, slots))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if not tagged:
+                    await asyncio.wait([task])
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _dispatch(self, session, msg, slots):
+        try:
+            await self.on_message(session, msg)
+        except Exception as e:
+            print(f"Error handling message from {session.peer}: {e!r}")
+        finally:
+            slots.release()
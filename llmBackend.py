@@ -0,0 +1,214 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ATTITUDES = ['Friendly', 'Wary', 'Fearful', 'Protective', 'Hostile', 'Grateful', 'Suspicious']
+RELATIONS = ['Friend', 'Avoid', 'Rival', 'Ally', 'Acquaintance']
+STATUSES = ['Talking', 'Listening', 'Alarmed', 'Rushing to aid', 'Confronted', 'Calm']
+LINES = [
+    "Did you see that? I can't believe it.",
+    "Stay back, I mean it.",
+    "Are you alright? Let me help you.",
+    "This village used to be quiet.",
+    "Mind your own business.",
+    "I'll remember this.",
+]
+
+
+class LLMBackend:
+    """
+    What Backend.py needs from an LLM session. ChatBotCrawler (Selenium),
+    FakeLLMBackend (in-process) and HTTPLLMBackend all implement it, and the
+    crawler pool can hold any mix of them.
+    """
+
+    name = 'llm'
+    last_wait = None
+
+    def send_message(self, message, on_update=None):
+        """Return the reply text; call on_update(text) with partial replies while it grows."""
+        raise NotImplementedError
+
+
+def sample_latency(rng, distribution):
+    """
+    `distribution` is ('fixed', s), ('uniform', lo, hi), ('normal', mean, sd)
+    or ('lognormal', median, sigma); values are seconds.
+    """
+    kind, *args = distribution
+    if kind == 'fixed':
+        return args[0]
+    if kind == 'uniform':
+        return rng.uniform(*args)
+    if kind == 'normal':
+        return max(0.0, rng.gauss(*args))
+    if kind == 'lognormal':
+        median, sigma = args
+        return rng.lognormvariate(0, sigma) * median
+    raise ValueError(f"unknown latency distribution {kind!r}")
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    Local stand-in for the chat session. Replies are schema-valid NPC reaction
+    arrays (attitude-change and dialogue records) built from the NPCs named in
+    the message, deterministic for a given message and seed. Time to first
+    token and typing speed follow configurable latency distributions, and
+    on_update receives the reply as it is "typed".
+    """
+
+    def __init__(self, npc_names=None, first_token=('lognormal', 0.8, 0.4), total=('lognormal', 3.0, 0.5),
+                 updates_per_second=20, seed=0, name='fake', time_scale=1.0):
+        self.npc_names = npc_names   # list, or a callable returning one
+        self.first_token = first_token
+        self.total = total
+        self.updates_per_second = updates_per_second
+        self.seed = seed
+        self.name = name
+        self.time_scale = time_scale
+        self.last_wait = None
+        self.turns = 0
+
+    def _names_in(self, message):
+        names = list(self.npc_names() if callable(self.npc_names) else (self.npc_names or []))
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = message
+        if isinstance(data, dict):
+            # NPCs listed in the relationship context count as known names
+            context = data.get('relationContext') or ''
+            for pair in re.findall(r"^([^>\n]+)>([^:\n]+):", context, re.M):
+                names.extend(pair)
+            text = ' '.join(str(v) for k, v in data.items() if k != 'relationContext')
+        else:
+            text = str(data)
+
+        lookup = {n.casefold(): n for n in names}
+        found = []
+        for word in re.findall(r"[^\W\d_]+", text):
+            name = lookup.get(word.casefold())
+            if name is None and not names and word[:1].isupper() and len(word) > 2:
+                name = word  # no roster: treat capitalised words as NPCs
+            if name is not None and name not in found:
+                found.append(name)
+        return found
+
+    def reply_records(self, message, rng):
+        names = self._names_in(message) or ['Villager', 'Stranger']
+        if len(names) == 1:
+            names.append('Villager')
+        speaker = names[rng.randrange(len(names))]
+        others = [n for n in names if n != speaker]
+        records = []
+        for other in others[:3]:
+            records.append({
+                'intermediatorID': speaker,
+                'AttAndRelRCPT': other,
+                'AttitudeChange': rng.choice(ATTITUDES),
+                'RelationshipTypeChange': rng.choice(RELATIONS),
+                'Rationale': f"{speaker} reacts to what {other} just did.",
+            })
+        for other in others[:2]:
+            records.append({
+                'intermediatorID': speaker,
+                'RecipientID': other,
+                'intermediatorStatus': rng.choice(STATUSES),
+                'RecipientStatus': rng.choice(STATUSES),
+                'intermediatorDialogue': rng.choice(LINES),
+                'RecipientDialogue': rng.choice(LINES),
+            })
+        return records
+
+    def send_message(self, message, on_update=None):
+        digest = hashlib.sha1(f"{self.seed}:{message}".encode('utf-8')).digest()
+        rng = random.Random(digest)
+        text = json.dumps(self.reply_records(message, rng), ensure_ascii=False)
+
+        start = time.perf_counter()
+        first = sample_latency(rng, self.first_token) * self.time_scale
+        total = max(first, sample_latency(rng, self.total) * self.time_scale)
+        time.sleep(first)
+        if on_update:
+            steps = max(1, int((total - first) * self.updates_per_second))
+            for i in range(1, steps + 1):
+                on_update(text[:len(text) * i // steps])
+                time.sleep((total - first) / steps)
+        else:
+            time.sleep(total - first)
+        self.turns += 1
+        self.last_wait = {'method': 'fake', 'seconds': time.perf_counter() - start}
+        return text
+
+
+class HTTPLLMBackend(LLMBackend):
+    """Client for `serve_http`, so the stand-in can run in another process or box."""
+
+    def __init__(self, url='http://127.0.0.1:8765/chat', name=None, timeout=120):
+        self.url = url
+        self.name = name or url
+        self.timeout = timeout
+        self.last_wait = None
+
+    def send_message(self, message, on_update=None):
+        start = time.perf_counter()
+        body = json.dumps({'message': message, 'stream': on_update is not None}).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        text = ''
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            for line in resp:
+                if not line.strip():
+                    continue
+                msg = json.loads(line)
+                text = msg['text']
+                if not msg.get('done') and on_update:
+                    on_update(text)
+        self.last_wait = {'method': 'http', 'seconds': time.perf_counter() - start}
+        return text
+
+
+def serve_http(backend, host='127.0.0.1', port=8765):
+    """
+    Serve `backend` over HTTP: POST /chat {"message": ..., "stream": bool}.
+    The response is newline-delimited {"text": ...} snapshots ending with
+    {"done": true, "text": ...}.
+    """
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            req = json.loads(self.rfile.read(length))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+
+            def emit(obj):
+                self.wfile.write(json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n')
+                self.wfile.flush()
+
+            on_update = (lambda text: emit({'text': text})) if req.get('stream') else None
+            if isinstance(backend, FakeLLMBackend):
+                text = backend.send_message(req['message'], on_update)  # stateless, safe to overlap
+            else:
+                with lock:
+                    text = backend.send_message(req['message'], on_update)
+            emit({'done': True, 'text': text})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Fake LLM listening on http://{host}:{port}/chat")
+    return server
+
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    serve_http(FakeLLMBackend(), port=port).serve_forever()
@@ -0,0 +1,230 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds; covers a sub-millisecond map update up to a minute-long chat turn
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, safe to observe from several threads."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate from the buckets (linear within a bucket), like histogram_quantile()."""
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+
+class Registry:
+    """Histograms and counters keyed by name and label set."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key, Histogram())
+        return hist
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def _tables(self):
+        # other threads add series while a scrape renders; iterate a copy
+        with self.lock:
+            return sorted(self.counters.items()), sorted(self.histograms.items())
+
+    def render(self):
+        """Prometheus text exposition format."""
+        out = []
+
+        def labels(pairs, extra=()):
+            items = [f'{k}="{v}"' for k, v in list(pairs) + list(extra)]
+            return '{' + ','.join(items) + '}' if items else ''
+
+        counters, histograms = self._tables()
+        for kind, table in (('counter', counters), ('histogram', histograms)):
+            typed = set()
+            for (name, pairs), value in table:
+                if name not in typed:
+                    typed.add(name)
+                    if name in self.help:
+                        out.append(f"# HELP {name} {self.help[name]}")
+                    out.append(f"# TYPE {name} {kind}")
+                if kind == 'counter':
+                    out.append(f"{name}{labels(pairs)} {value}")
+                    continue
+                with value.lock:
+                    counts, total, count = list(value.counts), value.sum, value.count
+                cumulative = 0
+                for bound, c in zip(value.buckets + (float('inf'),), counts):
+                    cumulative += c
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append(f"{name}_bucket{labels(pairs, [('le', le)])} {cumulative}")
+                out.append(f"{name}_sum{labels(pairs)} {total}")
+                out.append(f"{name}_count{labels(pairs)} {count}")
+        return '\n'.join(out) + '\n'
+
+    def summary(self):
+        """Human-readable p50/p95/p99 per histogram."""
+        lines = [f"{'metric':44s} {'count':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'mean':>9s}"]
+        counters, histograms = self._tables()
+        for (name, pairs), hist in histograms:
+            label = name + ''.join(f" {k}={v}" for k, v in pairs)
+            if not hist.count:
+                continue
+            q = [hist.quantile(p) for p in (0.5, 0.95, 0.99)]
+            lines.append(f"{label:44s} {hist.count:8d} " + ' '.join(f"{v * 1000:7.1f}ms" for v in q) +
+                         f" {hist.sum / hist.count * 1000:7.1f}ms")
+        for (name, pairs), value in counters:
+            lines.append(f"{name + ''.join(f' {k}={v}' for k, v in pairs):44s} {value:8d}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REGISTRY.describe('npc_stage_seconds', "Time spent in each stage of an event turn")
+_local = threading.local()
+
+
+class TurnTrace:
+    """Stage timings of one event turn, collected for the trace log."""
+
+    def __init__(self, event_id=None):
+        self.event_id = event_id
+        self.start = time.time()
+        self.stages = []
+        self.fields = {}
+
+    def add(self, stage, seconds):
+        self.stages.append((stage, seconds))
+
+    def to_dict(self):
+        return dict(self.fields, eventId=self.event_id, start=self.start,
+                    stages=[{'stage': s, 'ms': round(sec * 1000, 3)} for s, sec in self.stages])
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def use_trace(trace):
+    """Make `trace` the one spans on this thread report to (e.g. on a crawler thread)."""
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(stage, trace=None, registry=REGISTRY):
+    """Time the block into npc_stage_seconds{stage=...} and the turn's trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('npc_stage_seconds', elapsed, stage=stage)
+        trace = trace if trace is not None else current_trace()
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+def record(stage, seconds, trace=None, registry=REGISTRY):
+    """Like span() for a duration measured elsewhere."""
+    registry.observe('npc_stage_seconds', seconds, stage=stage)
+    trace = trace if trace is not None else current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+class TraceLog:
+    """Appends one JSON line per finished turn."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.lock = threading.Lock()
+
+    def write(self, trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def serve(host='127.0.0.1', port=9464, registry=REGISTRY):
+    """
+    GET /metrics serves the Prometheus text format, GET / a p50/p95/p99 table.
+    Runs on a daemon thread; returns the server (call shutdown() to stop it).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics'):
+                body, ctype = registry.render(), 'text/plain; version=0.0.4'
+            elif self.path in ('/', '/summary'):
+                body, ctype = registry.summary(), 'text/plain'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+from collections import Counter, deque
+
+import eventScheduler
+import metrics
+import responseCache
+
+SPECULATIVE_NOTE = ("Hypothetical event: describe how the NPCs would react if it happened, "
+                    "but do not treat it as having happened.")
+
+
+class Prefetcher:
+    """
+    Uses idle LLM time to answer events before they happen.
+
+    Every real event is observed: its normalized payload (as the cache sees it,
+    so eventId, priority and the other volatile fields do not count) is
+    counted, and "A <action> B" events also count as a template
+    "{a} <action> {b}" for actor A. While the scheduler is idle and no real
+    event arrived for `idle_after` seconds, the best-scoring predictions are
+    sent to the LLM as background turns and their replies stored in the
+    ResponseCache under the key the real event would have. Predictions are:
+
+    - repeats of events seen at least twice,
+    - templates of recent actors applied to the NPCs they have relations with,
+      with the other fields of the actor's latest event.
+
+    The cache key includes the participants' relation fingerprint, so a
+    prefetched reply stops matching as soon as one of their relationships
+    changes. At most `max_per_minute` speculative turns are issued, one at a
+    time, and nothing is applied to the world.
+    """
+
+    def __init__(self, world, cache, ask_llm, scheduler, participants, prepare=None, idle_after=2.0,
+                 max_per_minute=12, recent=50, targets_per_actor=5, max_tracked=1000, templates_per_actor=20):
+        self.world = world
+        self.cache = cache
+        self.ask_llm = ask_llm
+        self.scheduler = scheduler
+        self.participants = participants   # data -> NPC names in it
+        self.prepare = prepare             # data -> prompt text (e.g. with relation context)
+        self.max_tracked = max_tracked     # events, actors and prefetched keys kept, each
+        self.templates_per_actor = templates_per_actor
+        self.idle_after = idle_after
+        self.max_per_minute = max_per_minute
+        self.targets_per_actor = targets_per_actor
+        self.events = Counter()            # normalized payload (JSON) -> count
+        self.payloads = {}                 # normalized payload -> latest event with it, minus volatile fields;
+                                           # least recently seen first
+        self.shapes = {}                   # actor -> their latest event, minus volatile fields
+        self.templates = {}                # actor -> Counter of templates
+        self.recent_actors = deque(maxlen=recent)
+        self.issued = deque()              # times of recent speculative turns
+        self.prefetched = {}               # cache key -> issued at
+        self.last_event = time.monotonic()
+        self.stats = {'issued': 0, 'used': 0, 'stale': 0}   # stale: relations moved mid-turn
+        self._task = None
+
+    def observe(self, data):
+        """Record a real event (call before answering it)."""
+        self.last_event = time.monotonic()
+        text = data.get('starterAndAction')
+        if not text:
+            return
+        stable = responseCache.stable_fields(data)
+        normalized = responseCache.normalized_json(stable)
+        self.events[normalized] += 1
+        self.payloads.pop(normalized, None)
+        self.payloads[normalized] = stable
+        if len(self.events) > self.max_tracked:
+            self._prune_events()
+        names = self.participants(data)
+        words = text.split()
+        actor = next((n for n in names if text.startswith(n)), None)
+        target = next((n for n in names if n != actor and text.endswith(n)), None)
+        if actor and target and len(words) > 2:
+            template = '{a}' + text[len(actor):len(text) - len(target)] + '{b}'
+            templates = self.templates.setdefault(actor, Counter())
+            templates[template] += 1
+            if len(templates) > self.templates_per_actor:
+                self.templates[actor] = Counter(dict(templates.most_common(self.templates_per_actor // 2)))
+        if actor:
+            self.recent_actors.append(actor)
+            self.shapes[actor] = stable
+            if len(self.shapes) > self.max_tracked or len(self.templates) > self.max_tracked:
+                # only recent actors are ever predicted for
+                recent = set(self.recent_actors)
+                self.shapes = {a: v for a, v in self.shapes.items() if a in recent}
+                self.templates = {a: v for a, v in self.templates.items() if a in recent}
+
+    def _prune_events(self):
+        # keep the most frequent half, the more recently seen first among equal counts
+        order = {key: i for i, key in enumerate(self.payloads)}
+        keep = sorted(self.events, key=lambda k: (self.events[k], order[k]), reverse=True)[:self.max_tracked // 2]
+        self.events = Counter({key: self.events[key] for key in keep})
+        self.payloads = {key: self.payloads[key] for key in sorted(keep, key=order.get)}
+
+    def used(self, key):
+        """A real event was answered from the cache; count it if we put it there."""
+        if self.prefetched.pop(key, None) is not None:
+            self.stats['used'] += 1
+            metrics.REGISTRY.inc('npc_prefetch_total', outcome='used')
+
+    def hit_rate(self):
+        return self.stats['used'] / self.stats['issued'] if self.stats['issued'] else 0.0
+
+    def candidates(self):
+        """Predicted event payloads, best first."""
+        scored = {}   # normalized payload -> (score, payload)
+        for normalized, count in self.events.most_common(20):
+            if count >= 2:
+                scored[normalized] = (count, self.payloads[normalized])
+        npc_map = self.world.npc_map
+        for actor in dict.fromkeys(reversed(self.recent_actors)):
+            templates = self.templates.get(actor)
+            if not templates:
+                continue
+            targets = list((npc_map.get(actor) or {}))[:self.targets_per_actor]
+            recency = 1.0 / (1 + list(reversed(self.recent_actors)).index(actor))
+            shape = self.shapes.get(actor, {})
+            for template, count in templates.most_common(3):
+                for target in targets:
+                    data = dict(shape, starterAndAction=template.replace('{a}', actor).replace('{b}', target))
+                    normalized = responseCache.normalized_json(data)
+                    if count * recency > scored.get(normalized, (0, None))[0]:
+                        scored[normalized] = (count * recency, data)
+        return [data for _, data in sorted(scored.values(), key=lambda v: -v[0])]
+
+    def idle(self):
+        return (not self.scheduler.waiting and self.scheduler.free >= self.scheduler.slots and
+                time.monotonic() - self.last_event >= self.idle_after)
+
+    def _budget_left(self):
+        now = time.monotonic()
+        while self.issued and now - self.issued[0] > 60:
+            self.issued.popleft()
+        return len(self.issued) < self.max_per_minute
+
+    async def step(self):
+        """Issue at most one speculative turn; returns True if one was sent."""
+        if not self.idle() or not self._budget_left():
+            return False
+        for data in self.candidates():
+            key = self.cache.key(data, self.world.npc_map)
+            if key in self.cache:
+                continue
+            self.issued.append(time.monotonic())
+            self.stats['issued'] += 1
+            metrics.REGISTRY.inc('npc_prefetch_total', outcome='issued')
+            speculative = dict(data, speculative=SPECULATIVE_NOTE)
+            prompt = self.prepare(speculative) if self.prepare else json.dumps(speculative, ensure_ascii=False)
+            try:
+                await self.scheduler.acquire('background')
+            except eventScheduler.Dropped:
+                return True   # real traffic arrived first
+            try:
+                text = await self.ask_llm(prompt)
+                json.loads(text)
+            finally:
+                self.scheduler.release()
+            # only keep it if the relations it was generated from did not move meanwhile
+            if self.cache.key(data, self.world.npc_map) == key:
+                self.cache.put(key, text)
+                self.prefetched[key] = time.monotonic()
+                if len(self.prefetched) > self.max_tracked:
+                    del self.prefetched[next(iter(self.prefetched))]
+            else:
+                self.stats['stale'] += 1
+            return True
+        return False
+
+    async def run(self, poll=0.5):
+        while True:
+            try:
+                if not await self.step():
+                    await asyncio.sleep(poll)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Prefetch failed: {e!r}")
+                await asyncio.sleep(poll)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
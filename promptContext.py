@@ -0,0 +1,139 @@
+import itertools
+import json
+
+import NPCInfoTest
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ContextBuilder:
+    """
+    Builds the relationship context for one event: the k-hop neighbourhood of
+    the NPCs it mentions, rendered one line per pair, closest pairs first,
+    cut off at `token_budget`. Lines are memoized per pair and only re-rendered
+    when that pair's attitude, relation, score or latest change moves.
+    """
+
+    def __init__(self, npc_map, changes=None, hops=1, token_budget=300, recent_per_pair=2):
+        self.npc_map = npc_map
+        self.changes = changes
+        self.hops = hops
+        self.token_budget = token_budget
+        self.recent_per_pair = recent_per_pair
+        self._memo = {}          # (src, tgt) -> (state, line)
+        self._lookup = {}        # casefolded name -> name
+        self._lookup_size = -1
+
+    def participants(self, data):
+        if len(self.npc_map) != self._lookup_size:
+            self._lookup = {name.casefold(): name for name in self.npc_map}
+            self._lookup_size = len(self.npc_map)
+        return NPCInfoTest.event_participants(data, self.npc_map, self._lookup)
+
+    def _neighbours(self, name):
+        for tgt in self.npc_map.get(name) or {}:
+            yield name, tgt
+        # reverse edges are indexed on a RelationStore; a plain dict has none
+        sources_toward = getattr(self.npc_map, 'sources_toward', None)
+        if sources_toward:
+            for src in sources_toward(name):
+                yield src, name
+
+    def neighbourhood(self, names):
+        """Pairs within `hops` of `names`, in breadth-first order."""
+        seen_nodes, seen_pairs, pairs = set(names), set(), []
+        frontier = list(names)
+        for _ in range(self.hops):
+            nxt = []
+            for name in frontier:
+                for pair in self._neighbours(name):
+                    if pair in seen_pairs:
+                        continue
+                    seen_pairs.add(pair)
+                    pairs.append(pair)
+                    for n in pair:
+                        if n not in seen_nodes:
+                            seen_nodes.add(n)
+                            nxt.append(n)
+            frontier = nxt
+        return pairs
+
+    def _recent_changes(self):
+        tail = getattr(self.changes, 'tail', None)
+        if tail is None:
+            tail = self.changes[-500:] if self.changes else []
+        recent = {}
+        for c in tail:
+            if c.get('newAttitude') is None and c.get('newRelation') is None:
+                continue
+            recent.setdefault((c.get('source'), c.get('target')), []).append(c)
+        return recent
+
+    def _render(self, src, tgt, recent):
+        rel = (self.npc_map.get(src) or {}).get(tgt) or {}
+        history = recent.get((src, tgt), [])[-self.recent_per_pair:]
+        state = (rel.get('Attitude'), rel.get('relation'), rel.get('AttitudeScore'),
+                 tuple(c.get('seq', id(c)) for c in history))
+        memo = self._memo.get((src, tgt))
+        if memo and memo[0] == state:
+            return memo[1]
+
+        parts = [p for p in (rel.get('Attitude'), rel.get('relation')) if p]
+        line = f"{src}>{tgt}: {'/'.join(parts) or '?'}"
+        if rel.get('AttitudeScore') is not None:
+            line += f" ({rel['AttitudeScore']})"
+        for c in history:
+            moved = [f"{c.get(o) or '?'}->{c.get(n)}" for o, n in
+                     (('originalAttitude', 'newAttitude'), ('originalRelation', 'newRelation')) if c.get(n)]
+            line += f"; was {', '.join(moved)}"
+        self._memo[(src, tgt)] = (state, line)
+        return line
+
+    def build(self, data):
+        names = self.participants(data)
+        if not names:
+            return ''
+        recent = self._recent_changes()
+        lines, used = [], 0
+        for src, tgt in self.neighbourhood(names):
+            line = self._render(src, tgt, recent)
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            lines.append(line)
+            used += cost
+        return '\n'.join(lines)
+
+    def summary(self, token_budget=1500):
+        """
+        World-state digest for seeding a fresh chat: recently changed pairs
+        first (newest first), then the rest of the map, up to `token_budget`.
+        """
+        recent = self._recent_changes()
+        changed = list(reversed(list(recent)))
+        seen = set(changed)
+        rest = ((src, tgt) for src in self.npc_map for tgt in self.npc_map[src] if (src, tgt) not in seen)
+        lines, used = [], 0
+        for src, tgt in itertools.chain(changed, rest):
+            line = self._render(src, tgt, recent)
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            lines.append(line)
+            used += cost
+        return '\n'.join(lines)
+
+    def add_context(self, msg, data=None):
+        """The event text with a compact `relationContext` field added."""
+        if data is None:
+            data = json.loads(msg)
+        if not isinstance(data, dict):
+            return msg
+        context = self.build(data)
+        if not context:
+            return msg
+        return json.dumps(dict(data, relationContext=context), ensure_ascii=False)
@@ -0,0 +1,231 @@
+import bisect
+import itertools
+import re
+import time
+
+EVENT_NUMBER = re.compile(r"Event (\d+)")
+
+
+def event_number(change):
+    match = EVENT_NUMBER.match(change.get('event') or '')
+    return int(match.group(1)) if match else 0
+
+
+def _since(changes, since_seq):
+    """(seq, record) after `since_seq`, from a ChangeLog or a plain list (position is the seq)."""
+    if hasattr(changes, 'records'):
+        return ((c['seq'], c) for c in changes.records(since_seq))
+    return enumerate(itertools.islice(changes, since_seq, None), since_seq + 1)
+
+
+class Timeline:
+    """Change records in apply order with their event numbers and seqs, for bisecting by either."""
+
+    def __init__(self):
+        self.events = []
+        self.seqs = []
+        self.records = []
+
+    def add(self, event_no, seq, record):
+        self.events.append(event_no)
+        self.seqs.append(seq)
+        self.records.append(record)
+
+    def drop_before(self, seq):
+        """Forget the records before `seq`; returns how many are left."""
+        cut = bisect.bisect_left(self.seqs, seq)
+        del self.events[:cut], self.seqs[:cut], self.records[:cut]
+        return len(self.records)
+
+    def between(self, since_event=None, until_event=None, since_seq=None, limit=None):
+        lo, hi = 0, len(self.records)
+        if since_event is not None:
+            lo = bisect.bisect_right(self.events, since_event)
+        if since_seq is not None:
+            lo = max(lo, bisect.bisect_right(self.seqs, since_seq))
+        if until_event is not None:
+            hi = bisect.bisect_right(self.events, until_event)
+        if limit is not None and hi - lo > limit:
+            lo = hi - limit  # the newest `limit`
+        return self.records[lo:hi]
+
+
+class HistoryIndex:
+    """
+    Change history indexed per pair, per NPC (either side), per new label and
+    globally, kept current by `add` (a World listener). Event numbers only
+    grow, so every timeline stays sorted and range queries are two bisects.
+
+    Only the newest `window` records are indexed (None: all), so memory and
+    start-up stay flat however long the log grows. Queries that reach further
+    back read the older records from `changes` and filter them: slower, but
+    only they pay for it.
+    """
+
+    def __init__(self, changes=(), window=None):
+        self.changes = changes
+        self.window = window
+        self.by_pair = {}
+        self.by_npc = {}
+        self.by_label = {}
+        self.all = Timeline()
+        start = max(0, len(changes) - window) if window else 0
+        self.count = start            # records seen; the seq of records without one
+        self.first_seq = start + 1    # older records are only in `changes`
+        for _, record in _since(changes, start):
+            self.add(record)
+
+    def add(self, change):
+        self.count += 1
+        src, tgt = change.get('source'), change.get('target')
+        if not src or not tgt:
+            return
+        n, seq = event_number(change), change.get('seq', self.count)
+        self.all.add(n, seq, change)
+        for index, key in self._keys(change):
+            timeline = index.get(key)
+            if timeline is None:
+                timeline = index[key] = Timeline()
+            timeline.add(n, seq, change)
+        if self.window and len(self.all.records) > self.window + self.window // 4:
+            self._evict()
+
+    def _keys(self, change):
+        src, tgt = change['source'], change['target']
+        yield self.by_pair, (src, tgt)
+        yield self.by_npc, src
+        if tgt != src:
+            yield self.by_npc, tgt
+        for label in (change.get('newAttitude'), change.get('newRelation')):
+            if label is not None:
+                yield self.by_label, label
+
+    def _evict(self):
+        # in batches of a quarter window, so add stays amortized O(1)
+        drop = len(self.all.records) - self.window
+        old = self.all.records[:drop]
+        self.first_seq = self.all.seqs[drop]
+        self.all.drop_before(self.first_seq)
+        for change in old:
+            for index, key in self._keys(change):
+                timeline = index.get(key)
+                if timeline is not None and not timeline.drop_before(self.first_seq):
+                    del index[key]
+
+    def history(self, source=None, target=None, npc=None, label=None, since_event=None, until_event=None,
+                since_seq=None, limit=None):
+        if source and target:
+            timeline = self.by_pair.get((source, target))
+            match = lambda c: c['source'] == source and c['target'] == target
+        elif npc or source or target:
+            npc = npc or source or target
+            timeline = self.by_npc.get(npc)
+            match = lambda c: npc in (c['source'], c['target'])
+        elif label:
+            timeline = self.by_label.get(label)
+            match = lambda c: label in (c.get('newAttitude'), c.get('newRelation'))
+        else:
+            timeline = self.all
+            match = lambda c: True
+        found = timeline.between(since_event, until_event, since_seq, limit) if timeline else []
+        if self._reaches_back(since_event, since_seq) and (limit is None or len(found) < limit):
+            found = self._older(match, since_event, until_event, since_seq) + found
+            if limit is not None:
+                found = found[-limit:]
+        return found
+
+    def _reaches_back(self, since_event, since_seq):
+        if self.first_seq <= 1:
+            return False
+        if since_seq is not None and since_seq >= self.first_seq - 1:
+            return False
+        # event numbers grow with seq: nothing before the window is newer than its first event
+        return not (since_event is not None and self.all.events and since_event >= self.all.events[0])
+
+    def _older(self, match, since_event, until_event, since_seq):
+        """Matching records from before the window, read back from `changes`."""
+        found = []
+        for seq, change in _since(self.changes, since_seq or 0):
+            if seq >= self.first_seq:
+                break
+            if not change.get('source') or not change.get('target') or not match(change):
+                continue
+            n = event_number(change)
+            if until_event is not None and n > until_event:
+                break
+            if since_event is None or n > since_event:
+                found.append(change)
+        return found
+
+
+class QueryService:
+    """
+    Read-only requests on the game socket, answered from the RelationStore's
+    forward/reverse/label indexes and the HistoryIndex:
+
+      {"type": "relation", "source": "Celin", "target": "Alex"}
+      {"type": "relations", "npc": "Celin", "attitude": ..., "relation": ...}
+      {"type": "sources", "target": "Arthur", "relation": "Avoid"}
+      {"type": "pairs", "attitude": "Hostile"}
+      {"type": "history", "source": "Celin", "target": "Alex", "sinceEvent": 40}
+        (or "npc" / "label" instead of the pair; also "untilEvent", "sinceSeq", "limit")
+    """
+
+    TYPES = ('relation', 'relations', 'sources', 'pairs', 'history')
+
+    def __init__(self, npc_map, history, normalize=str.capitalize):
+        self.npc_map = npc_map
+        self.history = history
+        self.normalize = normalize
+
+    def _name(self, data, key):
+        value = data.get(key)
+        return self.normalize(value) if value else None
+
+    def relation(self, data):
+        rel = (self.npc_map.get(self._name(data, 'source')) or {}).get(self._name(data, 'target'))
+        return dict(rel) if rel is not None else None
+
+    def relations(self, data):
+        npc, attitude, relation = self._name(data, 'npc'), data.get('attitude'), data.get('relation')
+        targets = self.npc_map.get(npc) or {}
+        if (attitude or relation) and hasattr(self.npc_map, 'targets_of'):
+            names = self.npc_map.targets_of(npc, attitude, relation)
+        else:
+            names = list(targets)
+        return {t: dict(targets[t]) for t in names}
+
+    def sources(self, data):
+        target = self._name(data, 'target')
+        if hasattr(self.npc_map, 'sources_toward'):
+            return self.npc_map.sources_toward(target, data.get('attitude'), data.get('relation'))
+        # a plain dict has no reverse index
+        return [s for s, targets in self.npc_map.items() if target in targets and
+                _matches(targets[target], data.get('attitude'), data.get('relation'))]
+
+    def pairs(self, data):
+        attitude, relation = data.get('attitude'), data.get('relation')
+        if hasattr(self.npc_map, 'pairs_with'):
+            return [list(p) for p in self.npc_map.pairs_with(attitude, relation)]
+        return [[s, t] for s, targets in self.npc_map.items() for t, rel in targets.items()
+                if _matches(rel, attitude, relation)]
+
+    def history_records(self, data):
+        return self.history.history(
+            source=self._name(data, 'source'), target=self._name(data, 'target'),
+            npc=self._name(data, 'npc'), label=data.get('label'),
+            since_event=data.get('sinceEvent'), until_event=data.get('untilEvent'),
+            since_seq=data.get('sinceSeq'), limit=data.get('limit'))
+
+    def handle(self, session, data):
+        start = time.perf_counter()
+        kind = data['type']
+        handler = self.history_records if kind == 'history' else getattr(self, kind)
+        result = handler(data)
+        return {'type': 'result', 'query': kind, 'result': result,
+                'micros': round((time.perf_counter() - start) * 1e6, 1)}
+
+
+def _matches(rel, attitude, relation):
+    return ((attitude is None or rel.get('Attitude') == attitude) and
+            (relation is None or rel.get('relation') == relation))
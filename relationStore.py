@@ -0,0 +1,365 @@
+import math
+from array import array
+from collections.abc import MutableMapping
+
+# the three per-pair fields loaded from initialRelations.csv
+ATTITUDE, SCORE, RELATION = 'Attitude', 'AttitudeScore', 'relation'
+MISSING = -1
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class Interner:
+    """Two-way mapping between strings and dense integer codes."""
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def intern(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def lookup(self, name):
+        return self.codes.get(name)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class RelationStore(MutableMapping):
+    """
+    Column store for the NPC relation map.
+
+    NPC ids and attitude/relation labels are interned to ints; one row per
+    (source, target) pair lives in parallel arrays. Forward (source -> targets)
+    and reverse (target -> sources) adjacency plus per-label row sets keep
+    lookups proportional to the answer instead of to all pairs.
+
+    It still reads and writes like the old dict of dicts
+    (`store[src][tgt]['Attitude'] = ...`, `.get`, `.setdefault`), so
+    `update_npc_map_with_messages` and Backend.py work on it unchanged.
+    """
+
+    def __init__(self):
+        self.npcs = Interner()
+        self.labels = Interner()        # attitude and relation labels share codes
+        self.src = array('i')
+        self.tgt = array('i')
+        self.attitude = array('i')
+        self.relation = array('i')
+        self.score = array('d')
+        self.extra = {}                 # row -> any non-standard keys
+        self.pairs = {}                 # (src, tgt) -> row
+        self.forward = {}               # src -> {tgt: row}; also marks src as a top-level key
+        self.reverse = {}               # tgt -> {src: row}
+        self.by_attitude = {}           # label -> set(rows)
+        self.by_relation = {}
+        self.version = 0                # bumped on every write
+
+    @classmethod
+    def from_map(cls, npc_map):
+        store = cls()
+        for src, targets in npc_map.items():
+            store[src] = targets
+        return store
+
+    def to_columns(self):
+        """Live rows as plain arrays/lists, for compact checkpoints."""
+        rows = sorted(self.pairs.values())
+        if len(rows) == len(self.src):
+            pick = lambda col: col.tobytes()
+        else:
+            pick = lambda col: array(col.typecode, [col[r] for r in rows]).tobytes()
+        return {
+            'npcs': list(self.npcs.names), 'labels': list(self.labels.names),
+            'sources': list(self.forward),
+            'src': pick(self.src), 'tgt': pick(self.tgt),
+            'attitude': pick(self.attitude), 'relation': pick(self.relation), 'score': pick(self.score),
+            'extra': {i: dict(self.extra[r]) for i, r in enumerate(rows) if r in self.extra},
+        }
+
+    @classmethod
+    def from_columns(cls, cols):
+        store = cls()
+        for name in cols['npcs']:
+            store.npcs.intern(name)
+        for name in cols['labels']:
+            store.labels.intern(name)
+        for name in ('src', 'tgt', 'attitude', 'relation', 'score'):
+            getattr(store, name).frombytes(cols[name])
+        store.extra = dict(cols['extra'])
+        for code in cols['sources']:
+            store.forward[code] = {}
+        forward, reverse, pairs = store.forward, store.reverse, store.pairs
+        for row, (s, t) in enumerate(zip(store.src, store.tgt)):
+            pairs[(s, t)] = row
+            forward.setdefault(s, {})[t] = row
+            reverse.setdefault(t, {})[s] = row
+        for index, column in ((store.by_attitude, store.attitude), (store.by_relation, store.relation)):
+            for row, code in enumerate(column):
+                if code != MISSING:
+                    index.setdefault(code, set()).add(row)
+        return store
+
+    def to_dict(self):
+        return {src: {tgt: dict(rel) for tgt, rel in targets.items()} for src, targets in self.items()}
+
+    # --- dict-of-dicts view ---------------------------------------------------
+
+    def __getitem__(self, src):
+        code = self.npcs.lookup(src)
+        if code is None or code not in self.forward:
+            raise KeyError(src)
+        return SourceView(self, code)
+
+    def __setitem__(self, src, targets):
+        # copy first, `targets` may be a view onto the rows about to be dropped
+        targets = {tgt: dict(rel) for tgt, rel in dict(targets).items()}
+        code = self.npcs.intern(src)
+        for tgt in list(self.forward.get(code, ())):
+            self._delete_row(code, tgt)
+        self.forward[code] = {}
+        self.version += 1
+        view = SourceView(self, code)
+        for tgt, rel in targets.items():
+            view[tgt] = rel
+
+    def __delitem__(self, src):
+        code = self.npcs.lookup(src)
+        if code is None or code not in self.forward:
+            raise KeyError(src)
+        for tgt in list(self.forward[code]):
+            self._delete_row(code, tgt)
+        del self.forward[code]
+        self.version += 1
+
+    def __iter__(self):
+        names = self.npcs.names
+        return (names[code] for code in list(self.forward))
+
+    def __len__(self):
+        return len(self.forward)
+
+    def __contains__(self, src):
+        code = self.npcs.lookup(src)
+        return code is not None and code in self.forward
+
+    def setdefault(self, src, default=None):
+        # return the live view, not `default`, so chained setdefaults write through
+        if src not in self:
+            self[src] = default or {}
+        return self[src]
+
+    # --- rows -----------------------------------------------------------------
+
+    def _new_row(self, s, t):
+        row = len(self.src)
+        self.src.append(s)
+        self.tgt.append(t)
+        self.attitude.append(MISSING)
+        self.relation.append(MISSING)
+        self.score.append(math.nan)
+        self.pairs[(s, t)] = row
+        self.forward.setdefault(s, {})[t] = row
+        self.reverse.setdefault(t, {})[s] = row
+        self.version += 1
+        return row
+
+    def _delete_row(self, s, t):
+        row = self.pairs.pop((s, t))
+        del self.forward[s][t]
+        del self.reverse[t][s]
+        self._set_label(self.by_attitude, self.attitude, row, MISSING)
+        self._set_label(self.by_relation, self.relation, row, MISSING)
+        self.score[row] = math.nan
+        self.extra.pop(row, None)
+        self.version += 1
+
+    def _set_label(self, index, column, row, code):
+        old = column[row]
+        if old == code:
+            return
+        if old != MISSING:
+            index[old].discard(row)
+        if code != MISSING:
+            index.setdefault(code, set()).add(row)
+        column[row] = code
+        self.version += 1
+
+    def get_field(self, row, key):
+        if key == ATTITUDE or key == RELATION:
+            code = (self.attitude if key == ATTITUDE else self.relation)[row]
+            if code == MISSING:
+                raise KeyError(key)
+            return self.labels.names[code]
+        if key == SCORE:
+            v = self.score[row]
+            if math.isnan(v):
+                raise KeyError(key)
+            return int(v) if v.is_integer() else v
+        return self.extra[row][key]
+
+    def set_field(self, row, key, value):
+        if key == ATTITUDE or key == RELATION:
+            code = MISSING if _missing(value) else self.labels.intern(value)
+            if key == ATTITUDE:
+                self._set_label(self.by_attitude, self.attitude, row, code)
+            else:
+                self._set_label(self.by_relation, self.relation, row, code)
+        elif key == SCORE:
+            self.score[row] = math.nan if _missing(value) else float(value)
+            self.version += 1
+        else:
+            self.extra.setdefault(row, {})[key] = value
+            self.version += 1
+
+    def fields(self, row):
+        keys = []
+        if self.attitude[row] != MISSING:
+            keys.append(ATTITUDE)
+        if not math.isnan(self.score[row]):
+            keys.append(SCORE)
+        if self.relation[row] != MISSING:
+            keys.append(RELATION)
+        keys.extend(self.extra.get(row, ()))
+        return keys
+
+    # --- indexed queries --------------------------------------------------------
+
+    def _label_rows(self, attitude, relation):
+        """Rows matching the given labels, or None when no label filter is set."""
+        sets = []
+        for index, label in ((self.by_attitude, attitude), (self.by_relation, relation)):
+            if label is None:
+                continue
+            code = self.labels.lookup(label)
+            sets.append(index.get(code, set()) if code is not None else set())
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def _matches(self, row, attitude, relation):
+        labels = self.labels.names
+        if attitude is not None and (self.attitude[row] == MISSING or labels[self.attitude[row]] != attitude):
+            return False
+        if relation is not None and (self.relation[row] == MISSING or labels[self.relation[row]] != relation):
+            return False
+        return True
+
+    def sources_toward(self, target, attitude=None, relation=None):
+        """NPCs with a relation toward `target`, e.g. everyone Fearful of Arthur."""
+        code = self.npcs.lookup(target)
+        rows = self.reverse.get(code, {}) if code is not None else {}
+        names = self.npcs.names
+        return [names[s] for s, row in rows.items() if self._matches(row, attitude, relation)]
+
+    def targets_of(self, source, attitude=None, relation=None):
+        code = self.npcs.lookup(source)
+        rows = self.forward.get(code, {}) if code is not None else {}
+        names = self.npcs.names
+        return [names[t] for t, row in rows.items() if self._matches(row, attitude, relation)]
+
+    def pairs_with(self, attitude=None, relation=None):
+        """(source, target) pairs carrying the given labels, served from the label indexes."""
+        rows = self._label_rows(attitude, relation)
+        if rows is None:
+            rows = self.pairs.values()
+        names = self.npcs.names
+        return [(names[self.src[r]], names[self.tgt[r]]) for r in sorted(rows)]
+
+    def row_of(self, source, target):
+        s, t = self.npcs.lookup(source), self.npcs.lookup(target)
+        if s is None or t is None:
+            return None
+        return self.pairs.get((s, t))
+
+
+class SourceView(MutableMapping):
+    """`store[src]`: the targets of one source NPC."""
+
+    def __init__(self, store, code):
+        self.store = store
+        self.code = code
+
+    def _targets(self):
+        return self.store.forward.get(self.code, {})
+
+    def __getitem__(self, tgt):
+        t = self.store.npcs.lookup(tgt)
+        row = self._targets().get(t) if t is not None else None
+        if row is None:
+            raise KeyError(tgt)
+        return RelationView(self.store, row)
+
+    def __setitem__(self, tgt, rel):
+        store = self.store
+        t = store.npcs.intern(tgt)
+        rel = dict(rel)
+        row = self._targets().get(t)
+        if row is None:
+            row = store._new_row(self.code, t)
+        else:
+            for key in store.fields(row):
+                if key not in rel:
+                    RelationView(store, row).pop(key)
+        for key, value in rel.items():
+            store.set_field(row, key, value)
+
+    def __delitem__(self, tgt):
+        t = self.store.npcs.lookup(tgt)
+        if t is None or t not in self._targets():
+            raise KeyError(tgt)
+        self.store._delete_row(self.code, t)
+
+    def __iter__(self):
+        names = self.store.npcs.names
+        return (names[t] for t in list(self._targets()))
+
+    def __len__(self):
+        return len(self._targets())
+
+    def setdefault(self, tgt, default=None):
+        if tgt not in self:
+            self[tgt] = default or {}
+        return self[tgt]
+
+    def __repr__(self):
+        return repr({tgt: dict(rel) for tgt, rel in self.items()})
+
+
+class RelationView(MutableMapping):
+    """`store[src][tgt]`: one pair's fields, read and written in place."""
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.store.get_field(self.row, key)
+
+    def __setitem__(self, key, value):
+        self.store.set_field(self.row, key, value)
+
+    def __delitem__(self, key):
+        if key not in self.store.fields(self.row):
+            raise KeyError(key)
+        if key in (ATTITUDE, SCORE, RELATION):
+            self.store.set_field(self.row, key, None)
+        else:
+            del self.store.extra[self.row][key]
+
+    def __iter__(self):
+        return iter(self.store.fields(self.row))
+
+    def __len__(self):
+        return len(self.store.fields(self.row))
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import NPCInfoTest
+
+# payload fields that never change what the LLM should answer: delivery
+# details and the scheduler's hints (eventScheduler.classify, mergeKey)
+VOLATILE_FIELDS = ('eventId', 'stream', 'timestamp', 'priority', 'deadline', 'mergeKey',
+                   'playerInvolved', 'ambient', 'gossip')
+
+
+def normalized_json(data):
+    return json.dumps(normalize_payload(data), ensure_ascii=False, sort_keys=True)
+
+
+def stable_fields(data):
+    """The event without its volatile fields (top level only, original case)."""
+    return {k: v for k, v in data.items() if k not in VOLATILE_FIELDS}
+
+
+def normalize_payload(data):
+    """Canonical form of an event: sorted keys, case-folded, whitespace collapsed."""
+    if isinstance(data, dict):
+        return {k: normalize_payload(v) for k, v in sorted(data.items()) if k not in VOLATILE_FIELDS}
+    if isinstance(data, list):
+        return [normalize_payload(v) for v in data]
+    if isinstance(data, str):
+        return re.sub(r'\s+', ' ', data).strip().casefold()
+    return data
+
+
+class ResponseCache:
+    """
+    LLM reply cache keyed on the normalized event plus a fingerprint of the
+    participating NPCs' relations, so a cached reply is only reused while the
+    relationships it was generated from are unchanged.
+
+    Two tiers: an in-memory LRU (`max_entries`) and an optional sqlite file
+    (`disk_path`, capped at `max_disk_entries`). Entries expire after `ttl`
+    seconds in both.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, disk_path=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()  # key -> (expires_at, text)
+        self.lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        self._lookup = {}        # casefolded name -> name, for event_participants
+        self._lookup_of = None   # (id, size) of the map it was built from
+        self.db = None
+        if disk_path:
+            self.db = sqlite3.connect(disk_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                            "key TEXT PRIMARY KEY, text TEXT, expires_at REAL, used_at REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used_at)")
+            self.db.commit()
+
+    def key(self, data, npc_map):
+        if isinstance(data, str):
+            data = json.loads(data)
+        names = NPCInfoTest.event_participants(data, npc_map, self._participant_lookup(npc_map))
+        payload = normalized_json(data)
+        h = hashlib.sha1(payload.encode('utf-8'))
+        h.update(NPCInfoTest.relation_fingerprint(npc_map, names).encode('ascii'))
+        return h.hexdigest()
+
+    def _participant_lookup(self, npc_map):
+        if (id(npc_map), len(npc_map)) != self._lookup_of:
+            self._lookup = {name.casefold(): name for name in npc_map}
+            self._lookup_of = (id(npc_map), len(npc_map))
+        return self._lookup
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.memory[key]
+            if self.db is not None:
+                row = self.db.execute("SELECT text, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    self.db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+                    self.db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        # memory tier only, and without touching hit/miss counts or LRU order
+        entry = self.memory.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    def put(self, key, text):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self._remember(key, expires_at, text)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                (key, text, expires_at, now))
+                self._evict_disk(now)
+                self.db.commit()
+
+    def _remember(self, key, expires_at, text):
+        self.memory[key] = (expires_at, text)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now):
+        self.db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self.db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                        "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+            'evictions': self.evictions, 'entries': len(self.memory),
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
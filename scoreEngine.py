@@ -0,0 +1,223 @@
+import asyncio
+import math
+import time
+
+import numpy as np
+
+import metrics
+import relationStore
+
+# where an LLM-reported label pulls the pair's AttitudeScore (-100..100)
+ATTITUDE_SCORES = {
+    'Friendly': 60, 'Grateful': 50, 'Protective': 70, 'Loving': 80, 'Respectful': 40,
+    'Neutral': 0, 'Wary': -20, 'Suspicious': -30, 'Fearful': -50, 'Angry': -60, 'Hostile': -80,
+}
+RELATION_SCORES = {'Friend': 50, 'Ally': 40, 'Wife of': 70, 'Husband of': 70, 'Avoid': -40, 'Rival': -50}
+
+
+class ScoreEngine:
+    """
+    Numeric AttitudeScore dynamics over a RelationStore, vectorized over its
+    row arrays (no Python loop over pairs). Each `tick(dt)`:
+
+    1. decays every score toward its baseline with half-life `half_life`
+       seconds. The baseline is the pair's AttitudeScore in `baseline` (the
+       CSV map) and, for pairs missing there, the score when the engine first
+       saw the pair;
+    2. gossip: an NPC's score toward T moves toward the average score toward T
+       of the NPCs it likes (positive score), weighted by how much it likes
+       them, at `gossip_rate` per second. Friends of Alex cool toward Arthur
+       once Alex does. Only existing pairs change; no edges are invented;
+    3. applies queued LLM-reported attitude/relation changes, moving the
+       pair `impulse` of the way to the label's score (ATTITUDE_SCORES);
+
+    and writes the scores back into the store's score column in place.
+    Pairs whose score moved by at least `notify_step` are passed to
+    `on_scores` as change records (originalScore/newScore). New pairs join the
+    gossip paths within `rebuild_every` seconds.
+
+    The evolved scores are not written to the change log; they survive a
+    restart through the store's checkpoints.
+    """
+
+    def __init__(self, store, half_life=3600.0, gossip_rate=0.02, impulse=0.5, notify_step=1.0,
+                 rebuild_every=10.0, on_scores=None, baseline=None):
+        if not isinstance(store, relationStore.RelationStore):
+            raise TypeError("ScoreEngine needs a RelationStore")
+        self.store = store
+        self.half_life = half_life
+        self.gossip_rate = gossip_rate
+        self.impulse = impulse
+        self.notify_step = notify_step
+        self.rebuild_every = rebuild_every
+        self.on_scores = on_scores
+        self.baseline = np.array(store.score, dtype=np.float64)
+        for source, targets in (baseline or {}).items():
+            for target, rel in targets.items():
+                row = store.row_of(source, target)
+                value = rel.get('AttitudeScore')
+                if row is not None and value is not None and not math.isnan(value):
+                    self.baseline[row] = value
+        self.reported = np.array(store.score, dtype=np.float64)   # last value sent to on_scores
+        self.pending = {}      # row -> label score to move toward
+        self._shape = None
+        self._built = None
+        self.ticks = 0
+        self._task = None
+
+    # --- LLM changes --------------------------------------------------------------
+
+    def fold_change(self, change):
+        """World listener: queue the score impulse of an applied attitude/relation change."""
+        target = ATTITUDE_SCORES.get(change.get('newAttitude'))
+        if target is None:
+            target = RELATION_SCORES.get(change.get('newRelation'))
+        if target is None:
+            return
+        row = self.store.row_of(change.get('source'), change.get('target'))
+        if row is not None:
+            self.pending[row] = target
+
+    # --- structure ----------------------------------------------------------------
+
+    def _structure(self):
+        """Live rows, and the gossip paths between them (rebuilt at most every `rebuild_every` s)."""
+        store = self.store
+        shape = (len(store.src), len(store.pairs))
+        if shape == self._shape:
+            return
+        self._shape = shape
+        n_rows = shape[0]
+        if len(self.baseline) < n_rows:   # rows added since: their current score is their baseline
+            extra = np.array(store.score[len(self.baseline):], dtype=np.float64)
+            self.baseline = np.concatenate([self.baseline, extra])
+            self.reported = np.concatenate([self.reported, extra])
+        src = np.frombuffer(store.src, dtype=np.int32).astype(np.int64)
+        tgt = np.frombuffer(store.tgt, dtype=np.int32).astype(np.int64)
+        live = np.zeros(n_rows, dtype=bool)
+        live[list(store.pairs.values())] = True
+        self.live, self.src, self.tgt = live, src, tgt
+        # deleted rows are NaN, so stale paths only miss pairs added since the last rebuild
+        now = time.monotonic()
+        if self._built is not None and now - self._built < self.rebuild_every:
+            self._shape = None   # look again next tick
+            return
+        self._built = now
+        n = len(store.npcs)
+        # CSR over live rows by source
+        rows = np.flatnonzero(live)
+        by_src = rows[np.argsort(src[rows], kind='stable')]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src[by_src], minlength=n), out=indptr[1:])
+        # every path s -> f -> t whose pair s -> t also exists, as three row arrays
+        friend = tgt[by_src]
+        counts = indptr[friend + 1] - indptr[friend]
+        total = int(counts.sum())
+        starts = np.repeat(indptr[friend], counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        first = np.repeat(by_src, counts)               # s -> f
+        heard = by_src[starts + offsets]                # f -> t
+        s, t = src[first], tgt[heard]
+        keep = t != s
+        first, heard, keys = first[keep], heard[keep], s[keep] * n + t[keep]
+        pair_keys = src[rows] * n + tgt[rows]
+        key_order = np.argsort(pair_keys)
+        pair_keys, pair_rows = pair_keys[key_order], rows[key_order]
+        pos = np.searchsorted(pair_keys, keys)
+        pos[pos >= len(pair_keys)] = 0
+        hit = pair_keys[pos] == keys if len(pair_keys) else np.zeros(len(keys), dtype=bool)
+        self.path_first, self.path_heard = first[hit], heard[hit]
+        self.path_row = pair_rows[pos[hit]]             # s -> t
+
+    # --- tick -----------------------------------------------------------------------
+
+    def tick(self, dt=1.0):
+        """Advance `dt` seconds; returns how many pairs were reported to on_scores."""
+        self._structure()
+        store = self.store
+        score = np.frombuffer(store.score, dtype=np.float64)   # the store's own column, no copy
+        try:
+            old = score.copy()
+            known = self.live & ~np.isnan(old)
+
+            # 1. decay toward baseline
+            if self.half_life:
+                keep = 0.5 ** (dt / self.half_life)
+                base = np.where(np.isnan(self.baseline), 0.0, self.baseline)
+                score[known] = base[known] + (old[known] - base[known]) * keep
+
+            # 2. gossip along liked edges: listener s likes friend f (score > 0),
+            #    f's scores toward every t pull s's score toward t
+            if self.gossip_rate:
+                self._gossip(score, old, known, dt)
+
+            # 3. LLM-reported labels
+            if self.pending:
+                rows = np.fromiter(self.pending.keys(), dtype=np.int64, count=len(self.pending))
+                goal = np.fromiter(self.pending.values(), dtype=np.float64, count=len(self.pending))
+                self.pending = {}
+                cur = score[rows]
+                score[rows] = np.where(np.isnan(cur), goal, cur + (goal - cur) * self.impulse)
+
+            np.clip(score, -100.0, 100.0, out=score)
+            np.round(score, 2, out=score)
+            changed = self._moved(score)
+        finally:
+            del score   # release the buffer so the array can grow again
+        store.version += 1
+        self.ticks += 1
+        if self.on_scores and len(changed):
+            self.on_scores(self._records(changed))
+        return len(changed)
+
+    def _gossip(self, score, old, known, dt):
+        first, heard, rows = self.path_first, self.path_heard, self.path_row
+        w = old[first] / 100.0
+        use = known[rows] & known[heard] & (w > 0)     # only NPCs the listener likes are heeded
+        if not use.any():
+            return
+        rows, w, opinion = rows[use], w[use], old[heard[use]]
+        n_rows = len(score)
+        wsum = np.bincount(rows, weights=w, minlength=n_rows)
+        wx = np.bincount(rows, weights=w * opinion, minlength=n_rows)
+        target = np.flatnonzero(wsum)
+        heard_avg = wx[target] / wsum[target]
+        rate = min(1.0, self.gossip_rate * dt) * np.minimum(1.0, wsum[target])
+        score[target] += (heard_avg - old[target]) * rate
+
+    def _moved(self, score):
+        prev = self.reported
+        appeared = np.isnan(prev) & ~np.isnan(score)
+        return np.flatnonzero(self.live & ((np.abs(score - prev) >= self.notify_step) | appeared))
+
+    def _records(self, rows):
+        names = self.store.npcs.names
+        score = self.store.score
+        out = []
+        for row in rows.tolist():
+            old = self.reported[row]
+            out.append({'source': names[self.src[row]], 'target': names[self.tgt[row]],
+                        'originalScore': None if math.isnan(old) else float(old),
+                        'newScore': score[row]})
+            self.reported[row] = score[row]
+        return out
+
+    async def run(self, interval=1.0):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            try:
+                with metrics.span('score_tick'):
+                    self.tick(now - last)
+            except Exception as e:
+                print(f"Score tick failed: {e!r}")
+            last = now
+
+    def start(self, interval=1.0):
+        self._task = asyncio.ensure_future(self.run(interval))
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
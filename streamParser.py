@@ -0,0 +1,67 @@
+import json
+
+
+class IncrementalArrayParser:
+    """
+    Pulls complete objects out of a JSON array while it is still being typed.
+
+    `feed` takes the whole reply text seen so far (the crawler reports growing
+    snapshots, not deltas) and returns the objects that became complete since
+    the last call. Only the new tail of the text is scanned each time.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.pos = 0            # next character to scan
+        self.depth = 0          # bracket depth, the outer array is depth 1
+        self.in_string = False
+        self.escape = False
+        self.obj_start = None   # start of the current top-level element
+        self.count = 0          # objects emitted so far
+
+    def _reset(self):
+        emitted = self.count
+        self.__init__()
+        return emitted
+
+    def feed(self, text):
+        skip = 0
+        if not text.startswith(self.text[:self.pos]):
+            # the page re-rendered earlier text; rescan and drop what we sent
+            skip = self._reset()
+        self.text = text
+
+        records = []
+        i, n = self.pos, len(text)
+        while i < n:
+            c = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == '\\':
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in '[{':
+                self.depth += 1
+                if self.depth == 2 and c == '{':
+                    self.obj_start = i
+            elif c in ']}':
+                self.depth -= 1
+                if self.depth == 1 and c == '}' and self.obj_start is not None:
+                    try:
+                        obj = json.loads(text[self.obj_start:i + 1])
+                    except ValueError:
+                        obj = None
+                    self.obj_start = None
+                    if isinstance(obj, dict):
+                        if skip:
+                            skip -= 1
+                        else:
+                            records.append(obj)
+                        self.count += 1
+            i += 1
+        self.pos = i
+        return records
@@ -0,0 +1,164 @@
+import asyncio
+
+# delta field, change-record key of the old value, change-record key of the new value
+DELTA_FIELDS = (('attitude', 'originalAttitude', 'newAttitude'),
+                ('relation', 'originalRelation', 'newRelation'),
+                ('score', 'originalScore', 'newScore'))
+
+
+class Subscription:
+    def __init__(self):
+        self.npcs = set()
+        self.pairs = set()
+        self.everything = False
+
+
+class SubscriptionHub:
+    """
+    Pushes relationship deltas to the clients that asked for them.
+
+    A client subscribes to NPCs (every pair they are the source or target of),
+    to single (source, target) pairs, or to everything. `notify` is called for
+    each applied change; changes to the same pair within one `tick` are folded
+    into one delta (first old value, last new value) and a pair that ends up
+    where it started is not sent at all.
+    """
+
+    def __init__(self, npc_map, tick=0.05, normalize=str.capitalize):
+        self.npc_map = npc_map
+        self.tick = tick
+        self.normalize = normalize   # client spelling -> map key
+        self.subs = {}          # session -> Subscription
+        self.by_npc = {}        # name -> set of sessions
+        self.by_pair = {}       # (src, tgt) -> set of sessions
+        self.everyone = set()
+        self.pending = {}       # session -> {(src, tgt): delta}
+        self._flush_handle = None
+        self.sent = 0
+
+    def subscribe(self, session, npcs=(), pairs=(), everything=False):
+        sub = self.subs.setdefault(session, Subscription())
+        for name in npcs:
+            name = self.normalize(name)
+            sub.npcs.add(name)
+            self.by_npc.setdefault(name, set()).add(session)
+        for pair in pairs:
+            pair = self.normalize(pair[0]), self.normalize(pair[1])
+            sub.pairs.add(pair)
+            self.by_pair.setdefault(pair, set()).add(session)
+        if everything:
+            sub.everything = True
+            self.everyone.add(session)
+        return sub
+
+    def unsubscribe(self, session, npcs=(), pairs=(), everything=False):
+        sub = self.subs.get(session)
+        if sub is None:
+            return None
+        for name in npcs:
+            name = self.normalize(name)
+            sub.npcs.discard(name)
+            self._discard(self.by_npc, name, session)
+        for pair in pairs:
+            pair = self.normalize(pair[0]), self.normalize(pair[1])
+            sub.pairs.discard(pair)
+            self._discard(self.by_pair, pair, session)
+        if everything:
+            sub.everything = False
+            self.everyone.discard(session)
+        return sub
+
+    def drop(self, session):
+        """Forget a disconnected client."""
+        sub = self.subs.pop(session, None)
+        if sub is not None:
+            self._remove(session, sub)
+        self.pending.pop(session, None)
+
+    def _remove(self, session, sub):
+        for name in sub.npcs:
+            self._discard(self.by_npc, name, session)
+        for pair in sub.pairs:
+            self._discard(self.by_pair, pair, session)
+        self.everyone.discard(session)
+
+    @staticmethod
+    def _discard(index, key, session):
+        sessions = index.get(key)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del index[key]
+
+    def interested(self, src, tgt):
+        sessions = set(self.everyone)
+        sessions.update(self.by_npc.get(src, ()))
+        sessions.update(self.by_npc.get(tgt, ()))
+        sessions.update(self.by_pair.get((src, tgt), ()))
+        return sessions
+
+    def notify(self, change):
+        """Listener for World: queue the state delta of one applied change."""
+        if not self.subs:
+            return
+        src, tgt = change.get('source'), change.get('target')
+        if not src or not tgt or all(change.get(new) is None for _, _, new in DELTA_FIELDS):
+            return  # dialogue only, no state moved
+        sessions = self.interested(src, tgt)
+        if not sessions:
+            return
+        for session in sessions:
+            queued = self.pending.setdefault(session, {})
+            delta = queued.get((src, tgt))
+            if delta is None:
+                delta = queued[(src, tgt)] = {'source': src, 'target': tgt, 'old': {}, 'new': {}}
+            for field, old, new in DELTA_FIELDS:
+                if change.get(new) is None:
+                    continue
+                delta['old'].setdefault(field, change.get(old))
+                delta['new'][field] = change[new]
+            if change.get('seq') is not None:
+                delta['seq'] = change['seq']
+            if change.get('event'):
+                delta['event'] = change['event']
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if self.tick:
+            self._flush_handle = loop.call_later(self.tick, self.flush)
+        else:
+            self._flush_handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        self._flush_handle = None
+        pending, self.pending = self.pending, {}
+        for session, deltas in pending.items():
+            changes = []
+            for delta in deltas.values():
+                moved = {f: v for f, v in delta['new'].items() if delta['old'].get(f) != v}
+                if not moved:
+                    continue
+                delta['old'] = {f: delta['old'].get(f) for f in moved}
+                delta['new'] = moved
+                # the current score rides along so clients never need to ask for it
+                score = (self.npc_map.get(delta['source']) or {}).get(delta['target'], {}).get('AttitudeScore')
+                if score is not None:
+                    delta['score'] = score
+                changes.append(delta)
+            if changes:
+                self.sent += len(changes)
+                session.send_nowait({'type': 'delta', 'changes': changes})
+
+    def handle(self, session, data):
+        """Socket API: {"type": "subscribe" | "unsubscribe", "npcs": [...], "pairs": [[src, tgt]], "all": bool}."""
+        npcs, pairs = data.get('npcs') or [], data.get('pairs') or []
+        everything = bool(data.get('all'))
+        if data['type'] == 'subscribe':
+            sub = self.subscribe(session, npcs, pairs, everything)
+        else:
+            sub = self.unsubscribe(session, npcs, pairs, everything) or Subscription()
+        return {'type': 'subscriptions', 'npcs': sorted(sub.npcs),
+                'pairs': sorted(list(p) for p in sub.pairs), 'all': sub.everything}
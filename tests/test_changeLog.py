@@ -0,0 +1,53 @@
+import os
+
+import changeLog
+
+
+def fill(log, n, start=0):
+    for i in range(start, start + n):
+        log.append({'event': f"Event {i + 1} x", 'source': 'A', 'target': 'B', 'newAttitude': 'Wary'})
+
+
+def test_resume_continues_seq_and_tail(tmp_path):
+    log = changeLog.ChangeLog(str(tmp_path), tail=5)
+    fill(log, 12)
+    log.close()
+    log = changeLog.ChangeLog(str(tmp_path), tail=5)
+    assert log.seq == 12
+    assert log.tail[-1]['seq'] == 12
+    assert log.append({'source': 'A', 'target': 'B'}) == 13
+    assert [r['seq'] for r in log.records()] == list(range(1, 14))
+    log.close()
+
+
+def test_torn_write_is_cut_off_on_resume(tmp_path):
+    log = changeLog.ChangeLog(str(tmp_path))
+    fill(log, 3)
+    log.close()
+    segment = log.segments()[-1]
+    with open(segment, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 4, "source": "A", "tar')   # crashed mid-line
+    log = changeLog.ChangeLog(str(tmp_path))
+    assert log.seq == 3
+    assert log.append({'source': 'A', 'target': 'B'}) == 4
+    assert [r['seq'] for r in log.records()] == [1, 2, 3, 4]
+    log.close()
+
+
+def test_records_since_seq_across_segments(tmp_path):
+    log = changeLog.ChangeLog(str(tmp_path), segment_bytes=300, tail=3)
+    fill(log, 40)
+    assert len(log.segments()) > 3
+    assert [r['seq'] for r in log.records(since_seq=17)] == list(range(18, 41))
+    assert [r['seq'] for r in log.records(since_seq=38)] == [39, 40]   # from the tail
+    log.close()
+
+
+def test_records_skip_compacted_segments(tmp_path):
+    log = changeLog.ChangeLog(str(tmp_path), segment_bytes=300, tail=3)
+    fill(log, 40)
+    first = log.segments()[0]
+    covered = changeLog.first_seq(log.segments()[1]) - 1
+    os.remove(first)
+    assert [r['seq'] for r in log.records()] == list(range(covered + 1, 41))
+    log.close()
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import eventScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def outcome(task):
+    try:
+        await task
+        return 'admitted'
+    except eventScheduler.Dropped as e:
+        return e.reason
+
+
+def test_stale_background_is_dropped_normal_waits():
+    async def main():
+        scheduler = eventScheduler.PriorityScheduler(1, deadlines={'background': 0.01})
+        await scheduler.acquire('player')
+        background = asyncio.ensure_future(scheduler.acquire('background'))
+        normal = asyncio.ensure_future(scheduler.acquire('normal'))
+        await asyncio.sleep(0.05)
+        scheduler.release()
+        assert await outcome(normal) == 'admitted'   # outranks it, and has no deadline
+        scheduler.release()
+        assert await outcome(background) == 'stale'
+    run(main())
+
+
+def test_same_merge_key_keeps_the_newest():
+    async def main():
+        scheduler = eventScheduler.PriorityScheduler(1)
+        await scheduler.acquire('player')
+        older = asyncio.ensure_future(scheduler.acquire('background', merge_key='gossip'))
+        await asyncio.sleep(0)
+        newer = asyncio.ensure_future(scheduler.acquire('background', merge_key='gossip'))
+        await asyncio.sleep(0)
+        scheduler.release()
+        assert await outcome(older) == 'merged'
+        assert await outcome(newer) == 'admitted'
+        assert scheduler.stats['merged'] == 1
+    run(main())
+
+
+def test_full_queue_sheds_lower_priority_or_refuses():
+    async def main():
+        scheduler = eventScheduler.PriorityScheduler(1, max_queue=1)
+        await scheduler.acquire('player')
+        background = asyncio.ensure_future(scheduler.acquire('background'))
+        await asyncio.sleep(0)
+        player = asyncio.ensure_future(scheduler.acquire('player'))
+        await asyncio.sleep(0)
+        assert await outcome(background) == 'shed'
+        with pytest.raises(eventScheduler.Dropped) as busy:
+            await scheduler.acquire('normal')
+        assert busy.value.reason == 'busy'
+        scheduler.release()
+        assert await outcome(player) == 'admitted'
+    run(main())
+
+
+def test_classify():
+    assert eventScheduler.classify({'priority': 'high'}) == 'high'
+    assert eventScheduler.classify({'starterAndAction': 'Player hits Alex'}) == 'player'
+    assert eventScheduler.classify({'starterAndAction': 'Alex hums', 'ambient': True}) == 'background'
+    assert eventScheduler.classify({'starterAndAction': 'Alex hits Bob'}) == 'normal'
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import Backend
+import changeLog
+import queryIndex
+
+CSV = """SourceNPCID,TargerNPCID,Attitude,AttitudeScore,relation
+Alex1,Bob2,Friendly,50,Friend
+Bob2,Alex1,Friendly,50,Friend
+Celin3,Alex1,Neutral,0,Stranger
+"""
+
+
+@pytest.fixture
+def world_dir(tmp_path, monkeypatch):
+    (tmp_path / 'rel.csv').write_text(CSV)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Backend, 'CSV_PATH', 'rel.csv')
+    return tmp_path
+
+
+def play(world, events):
+    for src, tgt, attitude in events:
+        reply = [{'intermediatorID': src, 'AttAndRelRCPT': tgt, 'AttitudeChange': attitude}]
+        world.apply(json.dumps({'starterAndAction': f" {src} meets {tgt}"}), reply)
+
+
+def test_history_by_event_across_a_restart(world_dir):
+    world = Backend.open_world()
+    play(world, [('Alex', 'Bob', 'Wary'), ('Bob', 'Alex', 'Angry'), ('Celin', 'Alex', 'Friendly')])
+    Backend.close_world(world)
+
+    world = Backend.open_world()
+    assert world.event_count == 3
+    play(world, [('Alex', 'Bob', 'Friendly'), ('Bob', 'Celin', 'Wary')])
+    index = queryIndex.HistoryIndex(world.changes)
+    assert [queryIndex.event_number(c) for c in index.history()] == [1, 2, 3, 4, 5]
+    assert [c['seq'] for c in index.history(since_event=2)] == [3, 4, 5]
+    assert [c['seq'] for c in index.history(since_event=1, until_event=4)] == [2, 3, 4]
+    assert [c['newAttitude'] for c in index.history(source='Alex', target='Bob')] == ['Wary', 'Friendly']
+    Backend.close_world(world)
+
+
+def test_windowed_index_matches_full_index(tmp_path):
+    log = changeLog.ChangeLog(str(tmp_path), segment_bytes=2000)
+    names = ['Alex', 'Bob', 'Celin', 'Dana']
+    for i in range(200):
+        src, tgt = names[i % 4], names[(i // 4) % 4]
+        log.append({'event': f"Event {i // 2 + 1} x", 'source': src, 'target': tgt,
+                    'newAttitude': ['Wary', 'Friendly', 'Angry'][i % 3]})
+    full = queryIndex.HistoryIndex(log)
+    windowed = queryIndex.HistoryIndex(log, window=30)
+    for i in range(200, 240):   # live appends evict from the window
+        change = {'seq': log.append({'event': f"Event {i // 2 + 1} x", 'source': 'Alex', 'target': 'Bob'}),
+                  'event': f"Event {i // 2 + 1} x", 'source': 'Alex', 'target': 'Bob'}
+        full.add(change)
+        windowed.add(change)
+    assert windowed.first_seq > 1
+    queries = [{}, {'npc': 'Celin'}, {'source': 'Alex', 'target': 'Bob'}, {'label': 'Angry'},
+               {'since_event': 10}, {'since_event': 50, 'until_event': 90}, {'since_seq': 150},
+               {'npc': 'Dana', 'limit': 5}, {'source': 'Alex', 'target': 'Bob', 'since_event': 3, 'limit': 40}]
+    for query in queries:
+        assert [c['seq'] for c in windowed.history(**query)] == [c['seq'] for c in full.history(**query)], query
+    log.close()
@@ -0,0 +1,30 @@
+import pytest
+
+import wireProtocol
+
+
+def test_frames_split_at_every_byte():
+    codec = wireProtocol.FrameCodec('json', 'zlib', compress_min=16)
+    messages = [{'n': i, 'text': 'x' * (i * 40)} for i in range(5)]
+    stream = b''.join(codec.encode(m) for m in messages)
+    decoder = wireProtocol.FrameDecoder(codec)
+    got = []
+    for i in range(len(stream)):
+        got.extend(decoder.feed(stream[i:i + 1]))
+    assert got == messages
+
+
+def test_oversized_frame_is_rejected():
+    codec = wireProtocol.FrameCodec('json')
+    decoder = wireProtocol.FrameDecoder(codec, max_frame=100)
+    with pytest.raises(ValueError):
+        decoder.feed(codec.encode({'text': 'x' * 200}))
+
+
+def test_inflation_is_bounded():
+    codec = wireProtocol.FrameCodec('json', 'zlib', compress_min=1)
+    frame = codec.encode({'text': 'x' * 100000})
+    assert len(frame) < 1000
+    with pytest.raises(ValueError):
+        wireProtocol.FrameDecoder(codec, max_frame=1000).feed(frame)
+    assert wireProtocol.FrameDecoder(codec, max_frame=200000).feed(frame) == [{'text': 'x' * 100000}]
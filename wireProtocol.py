@@ -0,0 +1,117 @@
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # optional: without it only the JSON codec is offered
+    msgpack = None
+
+# Length-prefixed frames: 4-byte big-endian payload length, 1 flag byte, payload.
+HEADER = struct.Struct('>IB')
+FLAG_COMPRESSED = 0x01
+
+PROTOCOL = 'frames'
+# a client asks for frames by sending this JSON object as its first line, e.g.
+#   {"protocol": "frames", "codecs": ["msgpack", "json"], "compress": ["zlib"]}\n
+# and waits for the server's one-line answer before sending its first frame
+HELLO_PREFIX = b'{"protocol"'
+COMPRESS_MIN_BYTES = 1024
+MAX_FRAME_BYTES = 16 << 20
+
+
+def available_codecs():
+    return ['msgpack', 'json'] if msgpack is not None else ['json']
+
+
+def negotiate(hello):
+    """The server's answer to a client hello: first supported codec the client listed."""
+    wanted = hello.get('codecs') or [hello.get('codec') or 'json']
+    codec = next((c for c in wanted if c in available_codecs()), 'json')
+    compress = 'zlib' if 'zlib' in (hello.get('compress') or []) else None
+    return {'protocol': PROTOCOL, 'codec': codec, 'compress': compress, 'maxFrame': MAX_FRAME_BYTES}
+
+
+def is_hello(line):
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(obj, dict) and obj.get('protocol') == PROTOCOL:
+        return obj
+    return None
+
+
+class FrameCodec:
+    """Encodes objects into frames and decodes frame payloads for one connection."""
+
+    def __init__(self, codec='json', compress=None, compress_min=COMPRESS_MIN_BYTES, level=1):
+        if codec == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack is not installed")
+        self.codec = codec
+        self.compress = compress
+        self.compress_min = compress_min
+        self.level = level
+
+    def dumps(self, obj):
+        if self.codec == 'msgpack':
+            return msgpack.packb(obj, use_bin_type=True)
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, payload):
+        # payload is a memoryview into the receive buffer
+        if self.codec == 'msgpack':
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(bytes(payload))
+
+    def encode(self, obj):
+        payload = self.dumps(obj)
+        flags = 0
+        if self.compress and len(payload) >= self.compress_min:
+            packed = zlib.compress(payload, self.level)
+            if len(packed) < len(payload):
+                payload, flags = packed, FLAG_COMPRESSED
+        return HEADER.pack(len(payload), flags) + payload
+
+
+class FrameDecoder:
+    """
+    Incremental frame parser. Received bytes go into one bytearray; complete
+    payloads are handed to the codec as memoryview slices of it, and consumed
+    bytes are only dropped once they make up half the buffer.
+    """
+
+    def __init__(self, codec, max_frame=MAX_FRAME_BYTES):
+        self.codec = codec
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        messages = []
+        while len(self.buffer) - self.offset >= HEADER.size:
+            length, flags = HEADER.unpack_from(self.buffer, self.offset)
+            if length > self.max_frame:
+                raise ValueError("frame of %d bytes exceeds the %d byte limit" % (length, self.max_frame))
+            start = self.offset + HEADER.size
+            if len(self.buffer) - start < length:
+                break
+            messages.append(self._decode(start, length, flags))
+            self.offset = start + length
+        if self.offset and self.offset * 2 >= len(self.buffer):
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return messages
+
+    def _decode(self, start, length, flags):
+        # the view must be released before the bytearray is resized again
+        with memoryview(self.buffer) as view, view[start:start + length] as payload:
+            if flags & FLAG_COMPRESSED:
+                # inflate at most max_frame bytes, so a small frame cannot expand without bound
+                inflater = zlib.decompressobj()
+                data = inflater.decompress(payload, self.max_frame)
+                if inflater.unconsumed_tail:
+                    raise ValueError("compressed frame inflates past the %d byte limit" % self.max_frame)
+                return self.codec.loads(memoryview(data))
+            return self.codec.loads(payload)
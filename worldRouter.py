@@ -0,0 +1,576 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import signal
+import threading
+
+import Backend
+import metrics
+
+WORLD_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")   # also a directory name under WORLDS_DIR
+OPENING_TIMEOUT = 1.0   # seconds to wait for a first message that is not complete JSON yet
+
+
+# --- worker process -----------------------------------------------------------------
+
+class WorldHost:
+    """The worlds placed on one worker process, each with its own map, change log, LLM pool and port."""
+
+    def __init__(self, host):
+        self.host = host
+        self.worlds = {}   # world id -> (World, serving task)
+        self.jobs = Backend.make_jobs()   # one job pool per worker, shared by its worlds
+
+    async def open(self, world_id, port):
+        if world_id not in self.worlds:
+            # restore, log replay and attaching Chrome block; the other worlds on this loop keep running
+            loop = asyncio.get_running_loop()
+            world = await loop.run_in_executor(None, Backend.open_world, world_id, self.jobs)
+            try:
+                pool = await loop.run_in_executor(None, Backend.make_pool, world)
+            except Exception:
+                world.changes.close()
+                raise
+            disk = Backend.CACHE_DISK_PATH and os.path.join(Backend.WORLDS_DIR, world_id, "response_cache.sqlite")
+            task = asyncio.ensure_future(Backend.run_async(
+                world, pool, Backend.make_cache(disk), self.host, port))
+            self.worlds[world_id] = (world, task, pool)
+        return {'world': world_id, 'port': port}
+
+    async def close(self, world_id, timeout):
+        """Let connected sessions finish their events (up to `timeout` s), then checkpoint and close."""
+        world, task, pool = self.worlds.pop(world_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while world.clients and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        unfinished = world.clients
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        pool.close()
+        # exports and the final checkpoint block; the other worlds on this loop keep running
+        await loop.run_in_executor(None, Backend.close_world, world)
+        return {'world': world_id, 'seq': world.changes.seq, 'unfinished': unfinished}
+
+    async def stats(self):
+        return {world_id: {'events': world.event_count, 'clients': world.clients}
+                for world_id, (world, _, _) in self.worlds.items()}
+
+
+async def _serve_worker(conn, host):
+    loop = asyncio.get_running_loop()
+    requests = asyncio.Queue()
+
+    def read():
+        # Connection.recv blocks; a daemon thread keeps it off the loop on every platform
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                request = None
+            loop.call_soon_threadsafe(requests.put_nowait, request)
+            if request is None:
+                return
+
+    threading.Thread(target=read, daemon=True).start()
+    worlds = WorldHost(host)
+
+    async def answer(req_id, command, args):
+        try:
+            conn.send((req_id, True, await getattr(worlds, command)(*args)))
+        except Exception as e:
+            conn.send((req_id, False, repr(e)))
+
+    try:
+        while True:
+            request = await requests.get()
+            if request is None:   # router asked us to stop, or went away
+                break
+            asyncio.ensure_future(answer(*request))
+    finally:
+        await asyncio.gather(*(worlds.close(world_id, Backend.DRAIN_TIMEOUT) for world_id in list(worlds.worlds)))
+        if worlds.jobs:
+            worlds.jobs.close()
+
+
+def worker_main(conn, host, metrics_port=None):
+    # Ctrl+C reaches every process in the console; the router shuts workers down in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics_port:
+        metrics.serve(host, metrics_port)
+    asyncio.run(_serve_worker(conn, host))
+
+
+# --- router -------------------------------------------------------------------------
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.alive = False
+        self.worlds = set()
+        self.pending = {}   # request id -> future
+
+    def load(self, rates):
+        return sum(rates.get(w, 0.0) for w in self.worlds)
+
+
+class Link:
+    """One proxied client connection: client <-> the world's server in its worker."""
+
+    def __init__(self, world_id, client_writer, world_writer):
+        self.world_id = world_id
+        self.client_writer = client_writer
+        self.world_writer = world_writer
+        self.upstream = None     # task copying client -> world
+        self.done = asyncio.Event()
+
+    def drain(self):
+        """Stop forwarding the client's events; the world still answers those it has."""
+        if self.upstream is not None:
+            self.upstream.cancel()
+        if not self.world_writer.is_closing() and self.world_writer.can_write_eof():
+            self.world_writer.write_eof()
+
+    def close(self):
+        self.drain()
+        self.client_writer.close()
+        self.world_writer.close()
+
+
+class WorldRouter:
+    """
+    Front door for many worlds on one port. A client's first line
+    {"type": "world", "world": "<id>"} picks its world (any other first line
+    goes to the default world unchanged); the router opens the world on the
+    least loaded worker process if nothing hosts it yet, answers
+    {"type": "world", "world", "worker"} and from then on relays bytes both
+    ways, so newline JSON and frames work as with a single Backend.
+
+    Load is each world's events per second, polled from the workers every
+    `stats_every` seconds. `migrate` drains a world: new connections wait,
+    connected clients stop being forwarded while the world answers what it
+    already has, the source worker checkpoints and closes the world and the
+    destination reopens it from that checkpoint. Clients then reconnect.
+
+    A first line {"type": "router", "command": "worlds" | "migrate" |
+    "rebalance", ...} makes the connection an admin one instead.
+    """
+
+    def __init__(self, workers=4, host='127.0.0.1', port=7777, base_port=7800, drain_timeout=30.0,
+                 stats_every=2.0, default_world="default", auto_rebalance=False, metrics_port=None):
+        self.host = host
+        self.port = port
+        self.drain_timeout = drain_timeout
+        self.stats_every = stats_every
+        self.default_world = default_world
+        self.auto_rebalance = auto_rebalance
+        self.metrics_port = metrics_port
+        self.workers = [Worker(i) for i in range(workers)]
+        self.placement = {}   # world id -> Worker
+        self.ports = {}       # world id -> port of its server
+        self.free_ports = []
+        self.next_port = base_port
+        self.moving = {}      # world id -> Event set once it is open (again)
+        self.links = {}       # world id -> set of Link
+        self.counts = {}      # world id -> event count at the last poll
+        self.rates = {}       # world id -> events per second
+        self._ids = itertools.count(1)
+        self._ctx = multiprocessing.get_context('spawn')
+        self._server = None
+
+    # --- workers ------------------------------------------------------------------
+
+    def _spawn(self, worker):
+        ours, theirs = self._ctx.Pipe()
+        port = self.metrics_port + 1 + worker.index if self.metrics_port else None
+        worker.process = self._ctx.Process(target=worker_main, args=(theirs, self.host, port),
+                                           name=f"world-worker-{worker.index}", daemon=False)
+        worker.process.start()
+        worker.conn = ours
+        worker.alive = True
+        loop = asyncio.get_running_loop()
+
+        def read(conn=ours):
+            while True:
+                try:
+                    reply = conn.recv()
+                except (EOFError, OSError):
+                    reply = None
+                try:
+                    if reply is None:
+                        loop.call_soon_threadsafe(self._lost, worker, conn)
+                        return
+                    loop.call_soon_threadsafe(self._resolve, worker, reply)
+                except RuntimeError:
+                    return   # loop already closed
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def _resolve(self, worker, reply):
+        req_id, ok, result = reply
+        future = worker.pending.pop(req_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    def _lost(self, worker, conn):
+        if conn is not worker.conn or not worker.alive:
+            return   # an older process of this slot, or we are shutting down
+        print(f"Worker {worker.index} exited; its worlds reopen on next connect")
+        worker.alive = False
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"worker {worker.index} exited"))
+        worker.pending.clear()
+        for world_id in worker.worlds:
+            self.placement.pop(world_id, None)
+            self._release_port(world_id)
+        worker.worlds.clear()
+        self._spawn(worker)
+
+    async def call(self, worker, command, *args):
+        future = asyncio.get_running_loop().create_future()
+        req_id = next(self._ids)
+        worker.pending[req_id] = future
+        worker.conn.send((req_id, command, args))
+        return await future
+
+    def _take_port(self):
+        if self.free_ports:
+            return self.free_ports.pop()
+        self.next_port += 1
+        return self.next_port - 1
+
+    def _release_port(self, world_id):
+        port = self.ports.pop(world_id, None)
+        if port is not None:
+            self.free_ports.append(port)
+
+    # --- placement ------------------------------------------------------------------
+
+    def least_loaded(self, exclude=None):
+        live = [w for w in self.workers if w.alive and w is not exclude]
+        if not live:
+            raise RuntimeError("no worker available")
+        return min(live, key=lambda w: (w.load(self.rates), len(w.worlds), w.index))
+
+    async def ensure_open(self, world_id):
+        """(worker, port) hosting the world, opening it on the least loaded worker if needed."""
+        while world_id in self.moving:
+            await self.moving[world_id].wait()
+        worker = self.placement.get(world_id)
+        if worker is not None:
+            return worker, self.ports[world_id]
+        ready = self.moving[world_id] = asyncio.Event()
+        try:
+            worker = self.least_loaded()
+            await self._open_on(worker, world_id)
+            return worker, self.ports[world_id]
+        finally:
+            del self.moving[world_id]
+            ready.set()
+
+    async def _open_on(self, worker, world_id):
+        port = self._take_port()
+        worker.worlds.add(world_id)   # counted right away, so concurrent opens spread out
+        try:
+            await self.call(worker, 'open', world_id, port)
+        except Exception:
+            worker.worlds.discard(world_id)
+            self.free_ports.append(port)
+            raise
+        self.placement[world_id] = worker
+        self.ports[world_id] = port
+        print(f"World {world_id!r} on worker {worker.index}, port {port}")
+
+    async def migrate(self, world_id, dest=None):
+        source = self.placement.get(world_id)
+        if source is None:
+            raise KeyError(f"world {world_id!r} is not open")
+        if dest is None:
+            dest = self.least_loaded(exclude=source)
+        if dest is source:
+            return {'world': world_id, 'worker': source.index, 'moved': False}
+        ready = self.moving[world_id] = asyncio.Event()
+        try:
+            links = list(self.links.get(world_id, ()))
+            for link in links:
+                link.drain()
+            if links:
+                done = [asyncio.ensure_future(link.done.wait()) for link in links]
+                _, late = await asyncio.wait(done, timeout=self.drain_timeout)
+                for task in late:
+                    task.cancel()
+                for link in links:
+                    link.close()
+            closed = await self.call(source, 'close', world_id, self.drain_timeout)
+            source.worlds.discard(world_id)
+            del self.placement[world_id]
+            self._release_port(world_id)
+            await self._open_on(dest, world_id)
+        finally:
+            del self.moving[world_id]
+            ready.set()
+        print(f"Moved world {world_id!r} from worker {source.index} to {dest.index} at change {closed['seq']}")
+        return {'world': world_id, 'worker': dest.index, 'moved': True, 'seq': closed['seq'],
+                'unfinished': closed['unfinished']}
+
+    async def rebalance(self):
+        """Move one world from the busiest worker to the idlest when that evens them out."""
+        live = [w for w in self.workers if w.alive]
+        busiest = max(live, key=lambda w: w.load(self.rates))
+        idlest = min(live, key=lambda w: w.load(self.rates))
+        high, low = busiest.load(self.rates), idlest.load(self.rates)
+        if len(busiest.worlds) < 2 or busiest is idlest:
+            return None
+        world_id = min(busiest.worlds, key=lambda w: abs((high - self.rates.get(w, 0.0)) -
+                                                        (low + self.rates.get(w, 0.0))))
+        rate = self.rates.get(world_id, 0.0)
+        if not rate or abs((high - rate) - (low + rate)) >= high - low:
+            return None
+        return await self.migrate(world_id, idlest)
+
+    async def poll_stats(self):
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(self.stats_every)
+            now = loop.time()
+            for worker in self.workers:
+                if not worker.alive:
+                    continue
+                try:
+                    stats = await self.call(worker, 'stats')
+                except RuntimeError:
+                    continue
+                for world_id, s in stats.items():
+                    previous = self.counts.get(world_id, s['events'])
+                    self.rates[world_id] = max(0, s['events'] - previous) / (now - last)
+                    self.counts[world_id] = s['events']
+            last = now
+            if self.auto_rebalance and not self.moving:
+                try:
+                    await self.rebalance()
+                except Exception as e:
+                    print(f"Rebalance failed: {e!r}")
+
+    def describe(self):
+        return {'workers': [{'worker': w.index, 'alive': w.alive, 'load': round(w.load(self.rates), 3),
+                             'worlds': sorted(w.worlds)} for w in self.workers],
+                'worlds': {world_id: {'worker': worker.index, 'port': self.ports[world_id],
+                                      'eventsPerSecond': round(self.rates.get(world_id, 0.0), 3),
+                                      'clients': len(self.links.get(world_id, ()))}
+                           for world_id, worker in self.placement.items()}}
+
+    # --- clients ----------------------------------------------------------------------
+
+    async def _handle_client(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            first, hello, rest = await _read_opening(reader, OPENING_TIMEOUT)
+        except ConnectionError as e:
+            print(f"Dropping client {peer}: {e}")
+            writer.close()
+            return
+        if not first:
+            writer.close()
+            return
+        if hello.get('type') == 'router':
+            await self._admin(reader, writer, hello, rest)
+            return
+        if hello.get('type') == 'world':
+            world_id, first = str(hello.get('world') or self.default_world), rest
+        else:
+            world_id = self.default_world
+        if not WORLD_ID.match(world_id):
+            await _send(writer, {'type': 'error', 'error': f"bad world id {world_id!r}"})
+            writer.close()
+            return
+        try:
+            worker, port = await self.ensure_open(world_id)
+            world_reader, world_writer = await _connect(self.host, port)
+        except Exception as e:
+            await _send(writer, {'type': 'error', 'world': world_id, 'error': repr(e)})
+            writer.close()
+            return
+        if hello.get('type') == 'world':
+            await _send(writer, {'type': 'world', 'world': world_id, 'worker': worker.index})
+        print(f"Client {peer} -> world {world_id!r} (worker {worker.index})")
+        link = Link(world_id, writer, world_writer)
+        self.links.setdefault(world_id, set()).add(link)
+        try:
+            if first:
+                world_writer.write(first)
+            link.upstream = asyncio.ensure_future(_relay(reader, world_writer, half_close=True))
+            await _relay(world_reader, writer)
+        finally:
+            link.close()
+            self.links[world_id].discard(link)
+            link.done.set()
+
+    async def _admin(self, reader, writer, request, rest=b''):
+        while request is not None:
+            try:
+                reply = await self._command(request)
+            except Exception as e:
+                reply = {'type': 'error', 'error': repr(e)}
+            await _send(writer, reply)
+            line, sep, rest = rest.partition(b'\n')
+            if not sep:
+                line += await reader.readline()
+            request = _parse(line) if line or sep else None
+        writer.close()
+
+    async def _command(self, request):
+        command = request.get('command')
+        if command == 'worlds':
+            return dict(self.describe(), type='worlds')
+        if command == 'migrate':
+            dest = request.get('worker')
+            dest = self.workers[dest] if dest is not None else None
+            return dict(await self.migrate(request['world'], dest), type='migrated')
+        if command == 'rebalance':
+            return {'type': 'rebalanced', 'moved': await self.rebalance()}
+        raise ValueError(f"unknown router command {command!r}")
+
+    # --- lifecycle --------------------------------------------------------------------
+
+    async def serve(self):
+        for worker in self.workers:
+            self._spawn(worker)
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, limit=1 << 20)
+        print(f"World router listening on {self.host}:{self.port} with {len(self.workers)} workers...")
+        stats = asyncio.ensure_future(self.poll_stats())
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            stats.cancel()
+            self._server = None
+
+    def stop(self, timeout=None):
+        """Ask every worker to checkpoint and close its worlds, and wait for it."""
+        for worker in self.workers:
+            if worker.alive:
+                worker.alive = False
+                try:
+                    worker.conn.send(None)
+                except (OSError, BrokenPipeError):
+                    pass
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+
+
+def _parse(line):
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+
+async def _read_opening(reader, timeout, max_bytes=1 << 20):
+    """
+    A connection's first message, without needing the newline that old UE
+    clients never send: (bytes read, the first JSON object or {}, bytes after
+    it). Gives up with {} on a line that is not JSON, at EOF, or when nothing
+    complete arrived within `timeout` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    data = b''
+    while True:
+        head = data.lstrip()
+        if head:
+            try:
+                text = head.decode('utf-8')
+            except UnicodeDecodeError as e:
+                text = head[:e.start].decode('utf-8')   # a character cut in two by the read
+            try:
+                obj, end = json.JSONDecoder().raw_decode(text)
+            except ValueError:
+                if b'\n' in head:
+                    return data, {}, b''
+            else:
+                rest = head[len(text[:end].encode('utf-8')):]
+                if rest[:1] == b'\r':
+                    rest = rest[1:]
+                if rest[:1] == b'\n':
+                    rest = rest[1:]
+                return data, obj if isinstance(obj, dict) else {}, rest
+        remaining = deadline - loop.time()
+        if remaining <= 0 or len(data) >= max_bytes:
+            return data, {}, b''
+        try:
+            chunk = await asyncio.wait_for(reader.read(65536), remaining)
+        except asyncio.TimeoutError:
+            return data, {}, b''
+        if not chunk:
+            return data, {}, b''
+        data += chunk
+
+
+async def _send(writer, obj):
+    writer.write(json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n')
+    await writer.drain()
+
+
+async def _connect(host, port, attempts=50):
+    # a freshly opened world may still be binding its port
+    for attempt in range(attempts):
+        try:
+            return await asyncio.open_connection(host, port)
+        except ConnectionRefusedError:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def _relay(reader, writer, half_close=False):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        # the client is done sending; the world still owes it replies
+        if half_close and writer.can_write_eof():
+            writer.write_eof()
+    except ConnectionError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve many NPC worlds from a pool of worker processes")
+    parser.add_argument('--host', default=Backend.HOST)
+    parser.add_argument('--port', type=int, default=Backend.PORT)
+    parser.add_argument('--workers', type=int, default=Backend.ROUTER_WORKERS)
+    parser.add_argument('--base-port', type=int, default=Backend.WORKER_BASE_PORT)
+    parser.add_argument('--rebalance', action='store_true', help="move worlds off busy workers automatically")
+    args = parser.parse_args()
+    router = WorldRouter(args.workers, args.host, args.port, args.base_port, Backend.DRAIN_TIMEOUT,
+                         default_world=Backend.DEFAULT_WORLD, auto_rebalance=args.rebalance,
+                         metrics_port=Backend.METRICS_PORT)
+    try:
+        asyncio.run(router.serve())
+    except KeyboardInterrupt:
+        print("Shutting down world router.")
+    router.stop(Backend.DRAIN_TIMEOUT + 10)
+
+
+if __name__ == "__main__":
+    main()